@@ -1,12 +1,23 @@
-import base64
+import hashlib
 import json
-import time
-from datetime import datetime
-from io import BytesIO
+import tempfile
+import uuid
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import date, datetime
 
 import streamlit as st
-from openai import OpenAI
-from pdf2image import convert_from_bytes
+from PIL import Image
+
+from form_schema import build_schema, validate_values
+from contributions import get_default_provider, normalize_sin, total_contributions
+from cpp_rules import assess_age_eligibility, calculate_payment, request_narrative, start_age_scenarios
+from extraction_store import get_default_store
+from image_encoding import ENCODING_POLICIES, encode_image
+from instrumentation import Tracer
+from llm_cache import cached_completion, get_default_cache
+from openai_pool import get_session_client
+from pdf_pages import iter_page_images
+from speculative import get_default_executor
 
 IMG2JSON_SYSTEM_PROMPT = '''
 You are an expert document image analyzer. Given an image of a document page, you will answer specific user questions
@@ -19,6 +30,10 @@ IMG2JSON_USER_PROMPT = '''
 Fill in the blanks with the correct answers based on the image content. Return the answers in the JSON format below:
 '''
 
+REASK_PROMPT = '''
+Some earlier answers were missing or did not match the requested type, options or format. Answer these fields again.
+'''
+
 FIELDS_LIST = [
     {'ID': 'Social Insurance Number', 'type': 'int', 'page': 0},
     {'ID': 'Preferred Language', 'type': 'str', 'options': ['English', 'French'], 'page': 0},
@@ -68,17 +83,6 @@ CALCULATION_FIELDS = [
 ]
 
 
-def convert_pdf_to_images(pdf):
-    images = convert_from_bytes(pdf, fmt='png', thread_count=8)
-    return images
-
-
-def encode_image(image):
-    bfr = BytesIO()
-    image.save(bfr, format='png')
-    return base64.b64encode(bfr.getvalue()).decode('utf-8')
-
-
 def construct_img2json_user_prompt(fields_list, i):
     filtered_field_list = [field for field in fields_list if field['page'] == i]
     user_prompt_list = [IMG2JSON_USER_PROMPT, '{']
@@ -93,26 +97,143 @@ def construct_img2json_user_prompt(fields_list, i):
     return '\n'.join(user_prompt_list)
 
 
-def extract_json_from_image(client, image, user_prompt):
+# The prompts and schemas never change, so build them once per page with fields
+PAGE_PROMPTS = {i: construct_img2json_user_prompt(FIELDS_LIST, i) for i in sorted(PAGES)}
+PAGE_SCHEMAS = {i: build_schema([field for field in FIELDS_LIST if field['page'] == i]) for i in sorted(PAGES)}
+
+# Stored extractions are only reused while the fields and prompts they were made with are unchanged
+EXTRACTION_VERSION = hashlib.sha256(
+    json.dumps([FIELDS_LIST, IMG2JSON_SYSTEM_PROMPT, IMG2JSON_USER_PROMPT]).encode('utf-8')
+).hexdigest()
+
+
+def extract_json_from_image(client, image_url, user_prompt):
     messages = [
         {'role': 'system', 'content': IMG2JSON_SYSTEM_PROMPT},
         {'role': 'user', 'content': [
             {'type': 'text', 'text': user_prompt},
-            {'type': 'image_url', 'image_url': {'url': f'data:image/png;base64,{encode_image(image)}'}}
+            {'type': 'image_url', 'image_url': image_url}
         ]}
     ]
-    completion = client.chat.completions.create(
+    content = cached_completion(
+        client,
         model="gpt-4o",
         response_format={"type": "json_object"},
         messages=messages
     )
-    return json.loads(completion.choices[0].message.content)
+    return json.loads(content)
+
+
+def extract_page_values(client, pdf_bytes, i, page_dir, image_policy, tracer):
+    with tracer.span(i + 1, 'render'):
+        _, page_path = next(iter_page_images(pdf_bytes, [i], page_dir, dpi=image_policy['dpi']))
+    with Image.open(page_path) as screenshot, tracer.span(i + 1, 'encode'):
+        image_url = encode_image(screenshot, image_policy)
+    with tracer.span(i + 1, 'extract'):
+        values, invalid = validate_values(extract_json_from_image(client, image_url, PAGE_PROMPTS[i]), PAGE_SCHEMAS[i])
+
+    # Ask again for only the fields whose answers are missing or malformed
+    if invalid:
+        retry_fields = [field for field in FIELDS_LIST if field['page'] == i and field['ID'] in invalid]
+        user_prompt = REASK_PROMPT + construct_img2json_user_prompt(retry_fields, i)
+        with tracer.span(i + 1, 'reask'):
+            retried_values, still_invalid = validate_values(extract_json_from_image(client, image_url, user_prompt),
+                                                            build_schema(retry_fields))
+        values.update({key: value for key, value in retried_values.items() if key not in still_invalid})
+    return values
+
+
+def extract_form_values(client, pdf_bytes, image_policy, tracer, on_page=None):
+    # Render and read only the pages with fields, all at once, so the wait is about that of the slowest page
+    extracted_values = {}
+    with tempfile.TemporaryDirectory(prefix='cpp-') as page_dir, ThreadPoolExecutor(len(PAGE_PROMPTS)) as executor:
+        futures = {
+            executor.submit(extract_page_values, client, pdf_bytes, i, page_dir, image_policy, tracer): i
+            for i in PAGE_PROMPTS
+        }
+        try:
+            for future in as_completed(futures):
+                extracted_values[futures[future]] = future.result()
+                if on_page is not None:
+                    on_page(futures[future], extracted_values[futures[future]])
+        except BaseException:
+            for future in futures:
+                future.cancel()
+            raise
+    return dict(sorted(extracted_values.items()))
 
 
 def convert_id_to_key(id_string):
     return 'input_' + id_string.lower().replace(' ', '_')
 
 
+def input_value(field_id, value):
+    # The value an input widget shows for an answer; options the form does not have fall back to the first one
+    if field_id in FIELD_OPTIONS:
+        return value if value in FIELD_OPTIONS[field_id] else FIELD_OPTIONS[field_id][0]
+    return None if value is None else str(value)
+
+
+def set_inputs(extracted_values, corrections):
+    for values in extracted_values.values():
+        for k, v in values.items():
+            st.session_state[convert_id_to_key(k)] = input_value(k, corrections.get(k, v))
+
+
+def save_corrections():
+    # Keep the caseworker's edits with the document, so they survive a reload and re-upload
+    corrections = {}
+    for values in st.session_state['extracted_values'].values():
+        for k, v in values.items():
+            if st.session_state[convert_id_to_key(k)] != input_value(k, v):
+                corrections[k] = st.session_state[convert_id_to_key(k)]
+    get_default_store().update(st.session_state['document_key'], 'corrections', corrections)
+
+
+ASSESSMENT_KEYS = ['age_eligibility_assessment', 'past_contributions_assessment', 'cpp_eligible', 'payment_calculation']
+
+
+def reset_review(assessments):
+    # Drop the assessments of the previous document, then resume the review as far as it got with this one;
+    # the steps themselves are computed again from the restored inputs
+    for key in ASSESSMENT_KEYS:
+        st.session_state.pop(key, None)
+    st.session_state['saved_assessments'] = assessments
+    st.session_state['toggle_confirm_accuracy'] = 'age_eligibility_assessment' in assessments
+    st.session_state['toggle_confirm_eligibility'] = 'payment_calculation' in assessments
+    st.session_state['toggle_confirm_payment'] = False
+
+
+def save_assessments(keys):
+    # Record the assessments shown in this run, writing only when they change
+    assessments = {key: st.session_state[key] for key in keys}
+    if assessments and assessments != st.session_state.get('saved_assessments'):
+        get_default_store().update(st.session_state['document_key'], 'assessments', assessments)
+        st.session_state['saved_assessments'] = assessments
+
+
+def speculate_contributions(sin):
+    fixed_amount = float(st.secrets['CONTRIBUTIONS']) if 'CONTRIBUTIONS' in st.secrets else None
+    return get_default_executor().submit(total_contributions, get_default_provider(fixed_amount), normalize_sin(sin))
+
+
+def speculate_review():
+    # Start every step of the review from the current inputs, before the caseworker gets to it;
+    # each step is memoized on its own inputs, so an edit only reruns the steps that depend on it.
+    # Today's date is one of them, for the steps that depend on the applicant's current age
+    executor = get_default_executor()
+    today = datetime.combine(date.today(), datetime.min.time())
+    date_of_birth = st.session_state['input_date_of_birth']
+    pension_start = st.session_state['input_pension_start']
+    start_date = st.session_state['input_as_of_date'] if pension_start == 'As of' else None
+    contributions = speculate_contributions(st.session_state['input_social_insurance_number'])
+    return {
+        'age_eligibility': executor.submit(assess_age_eligibility, date_of_birth, today),
+        'contributions': contributions,
+        'payment': executor.submit(calculate_payment, date_of_birth, pension_start, start_date, contributions, today)
+    }
+
+
 def process_uploaded_pdf():
     uploaded_file = st.session_state['uploaded_pdf']
     if uploaded_file is not None:
@@ -120,17 +241,43 @@ def process_uploaded_pdf():
             # Save uploaded PDF
             status.update(label='Uploading PDF ...')
 
-            # Convert PDF to images
-            status.update(label='Scanning PDF pages ...')
-            screenshots = convert_pdf_to_images(uploaded_file.getvalue())
-
-            # Extract JSON from images
-            st.session_state['extracted_values'] = {}
-            for i in PAGES:
-                status.update(label=f'Extracting answers from page {i + 1} ...')
-                user_prompt = construct_img2json_user_prompt(FIELDS_LIST, i)
-                json_data = extract_json_from_image(openai_client, screenshots[i], user_prompt)
-                st.session_state['extracted_values'][i] = json_data
+            # Extract JSON from the pages with fields concurrently
+            status.update(label=f'Extracting answers from {len(PAGE_PROMPTS)} pages ...')
+            image_policy = ENCODING_POLICIES[st.secrets.get('IMAGE_POLICY', 'lossless')]
+            tracer = Tracer()
+            st.session_state['performance_trace'] = tracer
+
+            # Restore an earlier upload of the same file, with the corrections made to it
+            pdf_bytes = uploaded_file.getvalue()
+            document_key = hashlib.sha256(pdf_bytes).hexdigest()
+            st.session_state['document_key'] = document_key
+            stored = get_default_store().get(document_key, EXTRACTION_VERSION)
+            if stored is not None:
+                st.session_state['extracted_values'] = {int(i): values for i, values in stored['extracted'].items()}
+                st.session_state['restored_at'] = stored['created_at']
+                set_inputs(st.session_state['extracted_values'], stored['corrections'])
+                reset_review(stored['assessments'])
+                status.update(label='PDF restored from an earlier upload ...')
+                st.session_state['has_uploaded_pdf'] = True
+                return
+
+            def on_page(i, values):
+                status.update(label=f'Extracted answers from page {i + 1} ...')
+                # Look up the contributions as soon as the SIN is read, while the other pages are still being read
+                if values.get('Social Insurance Number') is not None:
+                    speculate_contributions(values['Social Insurance Number'])
+
+            st.session_state['extracted_values'] = extract_form_values(
+                openai_client,
+                pdf_bytes,
+                image_policy,
+                tracer,
+                on_page=on_page
+            )
+            get_default_store().save_extraction(document_key, EXTRACTION_VERSION, st.session_state['extracted_values'])
+            st.session_state.pop('restored_at', None)
+            set_inputs(st.session_state['extracted_values'], {})
+            reset_review({})
 
             # Finalize processing
             status.update(label='PDF successfully processed ...')
@@ -138,115 +285,46 @@ def process_uploaded_pdf():
     else:
         st.session_state.pop('has_uploaded_pdf', None)
         st.session_state.pop('extracted_values', None)
-        st.session_state.pop('age_eligibility_assessment', None)
-        st.session_state.pop('past_contributions_assessment', None)
-        st.session_state.pop('cpp_eligible', None)
-        st.session_state['toggle_confirm_accuracy'] = False
-
-
-def determine_age_eligibility(date_of_birth, client):
-    today = datetime.today().strftime('%Y-%m-%d')
-    user_prompt = f'''
-    The applicant was born on {date_of_birth} (YYYY-MM-DD).
-    Today's date is {today} (YYYY-MM-DD).
-    For the applicant to quality for CPP, they must be at least 60 years old as of today.
-    If the applicant is at least 60 years old, return AGE_REQUIREMENT_MET. Otherwise, return AGE_REQUIREMENT_NOT_MET.
-    In addition, provide the rationale of the assessment in one sentence.
-    '''
-    completion = client.chat.completions.create(
-        model="gpt-4o",
-        messages=[{'role': 'user', 'content': user_prompt}]
-    )
-    return completion.choices[0].message.content
+        st.session_state.pop('performance_trace', None)
+        st.session_state.pop('document_key', None)
+        st.session_state.pop('restored_at', None)
+        reset_review({})
 
 
-def calculate_payment(name, date_of_birth, pension_start, start_date, contribution_amount, client):
-    # Determine start date of payment
-    date_of_birth = datetime.strptime(date_of_birth, '%Y-%m-%d')
-    date_turning_60 = date_of_birth.replace(year=date_of_birth.year + 60)
-    date_turning_65 = date_of_birth.replace(year=date_of_birth.year + 65)
-    date_turning_70 = date_of_birth.replace(year=date_of_birth.year + 70)
-
-    if pension_start == 'As soon as I qualify':
-        pension_start_date = max(date_turning_60, datetime.today())
-    else:
-        pension_start_date = datetime.strptime(start_date, '%Y-%m')
-        pension_start_date = min(pension_start_date, date_turning_70)
-        pension_start_date = max(pension_start_date, date_turning_60)
-
-    # Calculate the difference with 65th birthday
-    delta_months = ((pension_start_date.year - date_turning_65.year) * 12 +
-                    pension_start_date.month - date_turning_65.month)
-
-    # Calculate the percentage difference in payment
-    percentage_impact = 0.0
-    if delta_months < 0:
-        percentage_impact = max(0.6 * delta_months, -36)
-    elif delta_months > 0:
-        percentage_impact = min(0.7 * delta_months, 42)
-
-    # Calculate the adjusted monthly payment
-    payment = contribution_amount / 240 * (1 + percentage_impact / 100)
-
-    # Construct the user prompt
-    user_prompt = f'''
-    The applicant's name is {name}.
-    The applicant was born on {date_of_birth} (YYYY-MM-DD).
-    The applicant intends to start receiving CPP pension benefits on {start_date} (YYYY-MM).
-    The applicant should start receiving benefits between the age of 60 and 70.
-    The adjusted pension start date should be {pension_start_date.strftime('%Y-%m-%d')}.
-    The applicant has made a total of ${contribution_amount:,.2f} in CPP contributions.
-    The total contributions should be spread across 20 years if the applicant starts receiving benefits at age of 65.
-    If the pension starts before age 65, it will be reduced by 0.6% for each month (or 7.2% per year) before the 65th
-    birthday. The maximum reduction is 36% if the applicant starts their pension at age 60. This reduction is permanent.
-    If the pension starts after age 65, it will increase by 0.7% for each month (or 8.4% per year) after the 65th
-    birthday. The maximum increase is 42% if starting the pension at age 70. The increase is permanent, and there
-    are no more increases after age 70.
-    The percentage delta between the projected monthly payment and the baseline monthly payment is {percentage_impact}%.
-    As such, the adjusted monthly payment is ${payment:,.2f}.
-    ---
-    Write a clear paragraph explaining the rationale behind the calculation. Retain key figures.
-    Do not have more than 2 decimal places for any number.
-    Below the rationale, write a Python code block that performs the above calculations. 
-    '''
-
-    # Use OpenAI to make calculations
-    completion = client.chat.completions.create(
-        model="gpt-4o",
-        messages=[{'role': 'user', 'content': user_prompt}]
-    )
+def trace_stage(stage):
+    # Record a step of the review flow on the trace of the current upload
+    return st.session_state['performance_trace'].span(None, stage)
 
-    return {
-        'pension_start_date': pension_start_date,
-        'delta_months': delta_months,
-        'percentage_impact': percentage_impact,
-        'payment': payment,
-        'rationale': completion.choices[0].message.content
 
-    }
+@st.fragment(run_every=1)
+def poll_narrative(future):
+    # Check back every second without rerunning the page, then rerun it once the narrative is written
+    if future.done():
+        st.rerun()
+    st.caption('Writing a narrative with AI ...')
 
 
 def toggle_inputs():
+    # The assessments themselves are kept by the speculative executor, keyed on the inputs
     if st.session_state['toggle_confirm_accuracy'] is False:
-        st.session_state.pop('age_eligibility_assessment', None)
-        st.session_state.pop('past_contributions_assessment', None)
         st.session_state.pop('cpp_eligible', None)
-        st.session_state.pop('payment_calculation', None)
-
-
-def toggle_eligibility():
-    if st.session_state['toggle_confirm_eligibility'] is False:
-        st.session_state.pop('payment_calculation', None)
 
 
 if __name__ == '__main__':
     # Page title
     st.title('CPP Application Processing')
 
-    # Initialize OpenAI Client
-    openai_client = OpenAI(
-        api_key=st.secrets['OPENAI_API_KEY']
-    )
+    # Show how often the LLM response cache saves a call
+    cache_stats = get_default_cache().stats()
+    st.sidebar.caption(f"LLM cache: {cache_stats['hits']} hits, {cache_stats['misses']} misses")
+    speculative_stats = get_default_executor().stats()
+    st.sidebar.caption(f"Precomputed steps: {speculative_stats['hits']} reused, {speculative_stats['misses']} run")
+    st.sidebar.toggle('Show performance details', key='show_performance')
+    st.sidebar.toggle('Write a payment narrative with AI', key='write_narrative')
+
+    # Share one pooled OpenAI client per server; the session id keeps rate limiting fair between users
+    session_id = st.session_state.setdefault('session_id', uuid.uuid4().hex)
+    openai_client = get_session_client(st.secrets['OPENAI_API_KEY'], session_id)
 
     # Upload scanned PDF for processing
     uploaded_pdf = st.file_uploader(
@@ -260,6 +338,10 @@ if __name__ == '__main__':
     if 'has_uploaded_pdf' in st.session_state:
         st.divider()
         st.subheader('Verify AI extracted information')
+        if 'restored_at' in st.session_state:
+            restored_at = datetime.fromtimestamp(st.session_state['restored_at'])
+            st.caption(f'Restored with its corrections and review from an upload of this file on '
+                       f'{restored_at:%Y-%m-%d %H:%M}')
         for idx in PAGES:
             if 'toggle_confirm_accuracy' not in st.session_state:
                 expanded = True
@@ -267,11 +349,14 @@ if __name__ == '__main__':
                 expanded = not st.session_state['toggle_confirm_accuracy']
 
             with st.expander(f'Inputs extracted from page {idx + 1}', expanded=expanded):
-                for k, v in st.session_state['extracted_values'][idx].items():
+                for k in st.session_state['extracted_values'][idx]:
                     if k in FIELD_OPTIONS:
-                        st.selectbox(k, options=FIELD_OPTIONS[k], key=convert_id_to_key(k))
+                        st.selectbox(k, options=FIELD_OPTIONS[k], key=convert_id_to_key(k), on_change=save_corrections)
                     else:
-                        st.text_input(k, value=v, key=convert_id_to_key(k))
+                        st.text_input(k, key=convert_id_to_key(k), on_change=save_corrections)
+
+        # Work ahead on the assessments while the caseworker checks the inputs
+        speculate_review()
 
         st.toggle(
             'I confirm the accuracy of the extracted information',
@@ -280,36 +365,31 @@ if __name__ == '__main__':
         )
 
     # Display eligibility assessment
+    shown_assessments = []
     if 'toggle_confirm_accuracy' in st.session_state and st.session_state['toggle_confirm_accuracy']:
         st.divider()
-        st.subheader('Confirm AI assessed eligibility')
+        st.subheader('Confirm assessed eligibility')
 
-        # Assess age eligibility
-        if 'age_eligibility_assessment' not in st.session_state:
-            with st.spinner('Assessing age eligibility ...'):
-                st.session_state['age_eligibility_assessment'] = determine_age_eligibility(
-                    st.session_state['input_date_of_birth'],
-                    openai_client
-                )
+        # Assess age eligibility, usually already done in the background
+        review = speculate_review()
+        with st.spinner('Assessing age eligibility ...'), trace_stage('age_eligibility'):
+            st.session_state['age_eligibility_assessment'] = review['age_eligibility'].result()
+        shown_assessments.append('age_eligibility_assessment')
 
         first_name = st.session_state['input_first_name']
 
-        if age_eligible := 'AGE_REQUIREMENT_MET' in st.session_state['age_eligibility_assessment']:
+        if age_eligible := st.session_state['age_eligibility_assessment']['eligible']:
             age_eligibility_header = f'✅ {first_name} is 60+ years old'
         else:
             age_eligibility_header = f'❌ {first_name} is under 60 years old'
 
         with st.expander(age_eligibility_header):
-            st.write(st.session_state['age_eligibility_assessment'])
+            st.write(st.session_state['age_eligibility_assessment']['rationale'])
 
         # Assess past contributions
-        if 'past_contributions_assessment' not in st.session_state:
-            with st.spinner('Assessing past contributions ...'):
-                time.sleep(2)
-                if 'CONTRIBUTIONS' in st.secrets:
-                    st.session_state['past_contributions_assessment'] = float(st.secrets['CONTRIBUTIONS'])
-                else:
-                    st.session_state['past_contributions_assessment'] = 0.0
+        with st.spinner('Assessing past contributions ...'), trace_stage('contributions'):
+            st.session_state['past_contributions_assessment'] = review['contributions'].result()
+        shown_assessments.append('past_contributions_assessment')
 
         contributions = st.session_state['past_contributions_assessment']
         if contributions > 0:
@@ -323,8 +403,8 @@ if __name__ == '__main__':
             st.write(contributions_body)
 
         # Assess overall eligibility
-        if 'cpp_eligible' not in st.session_state:
-            st.session_state['cpp_eligible'] = age_eligible and contributions > 0
+        st.session_state['cpp_eligible'] = age_eligible and contributions > 0
+        shown_assessments.append('cpp_eligible')
 
         if st.session_state['cpp_eligible']:
             st.write(f'✅ {first_name} is eligible for CPP benefits')
@@ -333,27 +413,19 @@ if __name__ == '__main__':
 
         st.toggle(
             'I confirm the correctness of eligibility assessments',
-            key='toggle_confirm_eligibility',
-            on_change=toggle_eligibility
+            key='toggle_confirm_eligibility'
         )
 
     # Display payment calculation
     if 'toggle_confirm_eligibility' in st.session_state and st.session_state['toggle_confirm_eligibility']:
         if 'cpp_eligible' in st.session_state and st.session_state['cpp_eligible']:
             st.divider()
-            st.subheader('Check AI calculated payment')
-
-            # Calculate payment
-            if 'payment_calculation' not in st.session_state:
-                with st.spinner('Calculating payment ...'):
-                    st.session_state['payment_calculation'] = calculate_payment(
-                        f"{st.session_state['input_first_name']} {st.session_state['input_last_name']}",
-                        st.session_state['input_date_of_birth'],
-                        st.session_state['input_pension_start'],
-                        st.session_state['input_as_of_date'],
-                        st.session_state['past_contributions_assessment'],
-                        openai_client
-                    )
+            st.subheader('Check calculated payment')
+
+            # Calculate payment, usually already done in the background
+            with st.spinner('Calculating payment ...'), trace_stage('payment_calculation'):
+                st.session_state['payment_calculation'] = speculate_review()['payment'].result()
+            shown_assessments.append('payment_calculation')
 
             col1, col2, col3 = st.columns(3)
 
@@ -382,6 +454,35 @@ if __name__ == '__main__':
                     expanded=True):
                 st.write(st.session_state['payment_calculation']['rationale'].replace('$', '\\$'))
 
+            # Compare the payment for every start month from 60 to 70
+            with st.expander('What if the pension started at another age'):
+                scenarios = start_age_scenarios(st.session_state['input_date_of_birth'],
+                                                st.session_state['past_contributions_assessment'])
+                st.line_chart(scenarios, x='Age at start', y='Monthly payment')
+                st.dataframe(scenarios, hide_index=True, column_config={
+                    'Age at start': st.column_config.NumberColumn(format='%.2f'),
+                    'Adjustment (%)': st.column_config.NumberColumn(format='%.1f'),
+                    'Monthly payment': st.column_config.NumberColumn(format='$%.2f')
+                })
+
+            # The AI narrative is written in the background, so the figures above never wait for it
+            if st.session_state.get('write_narrative'):
+                narrative = request_narrative(
+                    openai_client,
+                    f"{st.session_state['input_first_name']} {st.session_state['input_last_name']}",
+                    st.session_state['input_date_of_birth'],
+                    st.session_state['input_as_of_date'],
+                    st.session_state['past_contributions_assessment'],
+                    st.session_state['payment_calculation']
+                )
+                with st.expander('Narrative written by AI', expanded=True):
+                    if not narrative.done():
+                        poll_narrative(narrative)
+                    elif narrative.exception() is not None:
+                        st.warning(f'The narrative could not be written: {narrative.exception()}')
+                    else:
+                        st.write(narrative.result().replace('$', '\\$'))
+
             st.toggle('I confirm the correctness of payment calculation', key='toggle_confirm_payment')
 
     # Display communication button
@@ -393,3 +494,21 @@ if __name__ == '__main__':
         elif 'cpp_eligible' in st.session_state and not st.session_state['cpp_eligible']:
             st.divider()
             st.button('Reject CPP application', on_click=st.snow)
+
+    if 'has_uploaded_pdf' in st.session_state:
+        save_assessments(shown_assessments)
+
+    # Show where time and tokens went for the current application
+    if st.session_state.get('show_performance') and 'performance_trace' in st.session_state:
+        performance_trace = st.session_state['performance_trace']
+        st.divider()
+        st.subheader('Performance by stage')
+        st.dataframe(performance_trace.summary(), hide_index=True)
+
+        col1, col2 = st.columns(2)
+        with col1:
+            st.download_button('Download JSON trace', data=performance_trace.to_json, file_name='trace.json',
+                               mime='application/json')
+        with col2:
+            st.download_button('Download Prometheus metrics', data=performance_trace.to_prometheus,
+                               file_name='metrics.prom', mime='text/plain')
@@ -1,12 +1,26 @@
-import base64
 import json
-from io import BytesIO
+import queue
+import threading
+import time
+import uuid
+from concurrent.futures import FIRST_COMPLETED, CancelledError, ThreadPoolExecutor, wait
+from functools import partial
 
 import streamlit as st
-from llama_parse import LlamaParse
-from openai import OpenAI
-from openpyxl import Workbook
-from pdf2image import convert_from_bytes
+from PIL import Image
+
+from batch_backend import DeferredRequest
+from exports import EXPORT_FORMATS, digest_extracts
+from image_encoding import ENCODING_POLICIES, encode_crop, encode_image
+from instrumentation import Tracer
+from llm_cache import cached_completion, get_default_cache
+from markdown_tables import parse_table_chunk, split_table_chunks
+from ocr_engines import create_ocr_engine
+from openai_pool import get_session_client
+from page_dedup import PageDeduplicator
+from page_store import PageHandle, get_default_store, store_page_images
+from pdf_pages import count_pages
+from table_detection import find_table_regions, table_score
 
 IMG2MD_SYSTEM_PROMPT = '''
 You are an expert document parser.
@@ -96,156 +110,369 @@ The JSON response should follow this format:
 }
 '''
 
-
-def read_files_using_llama_parse(f):
-    parser = LlamaParse(
-        api_key=st.secrets['LLAMA_CLOUD_API_KEY'],
-        result_type='markdown',
-        verbose=True
-    )
-    return parser.load_data(f, extra_info={'file_name': f.name})
+CROPPED_PAGE_NOTE = 'The images below are the regions of the page that contain tables, from top to bottom.'
 
 
-def encode_image(image):
-    bfr = BytesIO()
-    image.save(bfr, format='png')
-    return base64.b64encode(bfr.getvalue()).decode('utf-8')
+def encode_page(image, settings):
+    # Send only the table regions of a page when they stand out, introduced so the model knows it sees parts of it.
+    # This is opt-in: the crops cost fewer tokens, but the transcription then leaves out the rest of the page's text
+    regions = find_table_regions(image) if settings.get('table_cropping') else []
+    if not regions:
+        return [{'type': 'image_url', 'image_url': encode_image(image, settings['image_policy'])}]
+    image_parts = [{'type': 'text', 'text': CROPPED_PAGE_NOTE}]
+    for region in regions:
+        image_parts.append({'type': 'image_url', 'image_url': encode_crop(image, region, settings['image_policy'])})
+    return image_parts
 
 
-def extract_tables_from_image(client, image, ocr_string):
+def extract_tables_from_image(client, image_parts, ocr_string):
     messages = [
         {'role': 'system', 'content': IMG2MD_SYSTEM_PROMPT},
         {'role': 'user', 'content': [
             {'type': 'text', 'text': IMG2MD_USER_PROMPT.format(ocr=ocr_string)},
-            {'type': 'image_url', 'image_url': {'url': f'data:image/png;base64,{encode_image(image)}'}}
+            *image_parts
         ]}
     ]
-    completion = client.chat.completions.create(
+    return cached_completion(
+        client,
         model="gpt-4o",
         messages=messages
     )
-    return completion.choices[0].message.content
 
 
-def format_markdown_tables(client, markdown_content, image):
+def format_markdown_tables(client, markdown_content, image_parts):
     user_prompt = FORMAT_TABLES_USER_PROMPT.format(transcription=markdown_content)
     messages = [
         {'role': 'system', 'content': FORMAT_TABLES_SYSTEM_PROMPT},
         {'role': 'user', 'content': [
             {'type': 'text', 'text': user_prompt},
-            {'type': 'image_url', 'image_url': {'url': f'data:image/png;base64,{encode_image(image)}'}}
+            *image_parts
         ]}
     ]
-    completion = client.chat.completions.create(
+    return cached_completion(
+        client,
         model="gpt-4o",
         messages=messages
     )
-    return completion.choices[0].message.content
 
 
-def convert_markdown_to_json(client, markdown_content):
+def convert_markdown_to_json_with_llm(client, markdown_content):
     user_prompt = 'Here is the markdown transcription:\n' + markdown_content + '\n---\n' + MD2JSON_USER_PROMPT
     messages = [
         {'role': 'system', 'content': MD2JSON_SYSTEM_PROMPT},
         {'role': 'user', 'content': user_prompt}
     ]
-    completion = client.chat.completions.create(
+    content = cached_completion(
+        client,
         model="gpt-4o",
         response_format={"type": "json_object"},
         messages=messages
     )
-    return json.loads(completion.choices[0].message.content)
-
-
-def create_excel_binary_from_json(json_data):
-    wb = Workbook()
-    ws_original = wb.active
+    return json.loads(content)
 
-    # Add tables to Excel by page
-    for page in sorted(json_data.keys()):
-        ws = wb.create_sheet(f'Page {page}')
-        for table in json_data[page]:
-            ws.append([table['title']])
-            ws.append([])
-            for row in table['content']:
-                ws.append(row)
-            ws.append([])
-            ws.append([])
 
-    # Save workbook to binary stream
-    wb.remove(ws_original)
-    binary_stream = BytesIO()
-    wb.save(binary_stream)
-    binary_content = binary_stream.getvalue()
-
-    return binary_content
+def convert_markdown_to_json(client, markdown_content):
+    # Parse the formatted tables locally, and only ask the LLM to convert tables that fail validation
+    tables = []
+    for chunk, terminated in split_table_chunks(markdown_content):
+        parsed_tables = parse_table_chunk(chunk, terminated)
+        if parsed_tables is None:
+            parsed_tables = convert_markdown_to_json_with_llm(client, chunk)['tables']
+        tables.extend(parsed_tables)
+    return {'tables': tables}
+
+
+@st.cache_data(max_entries=16, show_spinner=False)
+def build_export(digest, export_format, _table_extracts):
+    # Memoized on the digest of the extracted tables, so reruns do not rebuild the file
+    return EXPORT_FORMATS[export_format]['builder'](_table_extracts)
+
+
+@st.cache_data(max_entries=16, show_spinner=False)
+def build_transcription(digest, _text_extracts):
+    return '\n\n'.join(_text_extracts).encode('utf-8')
+
+
+def load_settings():
+    return {
+        'max_workers': st.secrets.get('PDF_MAX_WORKERS', 4),
+        'image_policy': ENCODING_POLICIES[st.secrets.get('IMAGE_POLICY', 'lossless')],
+        'table_threshold': st.secrets.get('TABLE_DETECTION_THRESHOLD', 0.5),
+        'ocr_engine': st.secrets.get('OCR_ENGINE',
+                                     'llamaparse' if 'LLAMA_CLOUD_API_KEY' in st.secrets else 'tesseract'),
+        'dedup_hash_distance': st.secrets.get('DEDUP_HASH_DISTANCE', 6),
+        'dedup_text_similarity': st.secrets.get('DEDUP_TEXT_SIMILARITY', 0.9),
+        'table_cropping': st.secrets.get('TABLE_CROPPING', False)
+    }
+
+
+def process_page(client, open_page, ocr_future, settings, report, trace, queued_at, page=None, dedup=None):
+    # Wait for this page's OCR text, which is produced alongside rasterization
+    report('Scanning page using OCR ...')
+    with trace('ocr', queued_at=queued_at):
+        ocr_string = ocr_future.result()
+
+    with Image.open(open_page()) as image:
+        # Reuse the results of an earlier near-identical page, e.g. a repeated cover sheet or boilerplate
+        if dedup is not None:
+            with trace('dedup'):
+                duplicate = dedup.claim(page, ocr_string, image)
+            if duplicate is not None:
+                report(f"Same as page {duplicate['duplicate_of']}, reusing its results ...")
+                return dict(dedup.result(duplicate), duplicate=duplicate)
+
+        # Skip the vision stages on pages where a local pre-pass finds no table, keeping the OCR text
+        with trace('detect'):
+            has_table = table_score(ocr_string, image) >= settings['table_threshold']
+        if not has_table:
+            report('No table detected, skipping AI vision ...')
+            return {'text_extract': ocr_string, 'formatted_table': 'NO_TABLE_PRESENT', 'tables': None, 'skipped': True}
+
+        # Encode the rendered page, or its table regions, once and reuse them for both vision stages
+        with trace('encode'):
+            image_parts = encode_page(image, settings)
+
+    # Use OpenAI to extract Markdown text content from image
+    report('Transcribing content using AI vision ...')
+    with trace('transcribe'):
+        text_from_image = extract_tables_from_image(client, image_parts, ocr_string)
+
+    # Format Markdown tables properly
+    report('Extracting tables using AI ...')
+    with trace('format'):
+        formatted_table = format_markdown_tables(client, text_from_image, image_parts)
+
+    # Convert Markdown tables to JSON
+    tables = None
+    if 'NO_TABLE_PRESENT' not in formatted_table:
+        report('Converting tables into Excel ...')
+        with trace('convert'):
+            tables = convert_markdown_to_json(client, formatted_table)['tables']
+
+    return {'text_extract': text_from_image, 'formatted_table': formatted_table, 'tables': tables, 'skipped': False}
+
+
+def relay_progress(futures, events, results, deferred, on_progress, on_result, timeout):
+    # Relay progress from the workers, since only the script thread may update the UI
+    pending = [future for future, i in futures.items() if i not in results and i not in deferred]
+    done, _ = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+    while not events.empty():
+        on_progress(*events.get())
+    for future in done:
+        i = futures[future]
+        try:
+            results[i] = future.result()
+        except DeferredRequest:
+            # The page stopped at a stage whose answer comes from a batch, and is left out until a later round
+            deferred.add(i)
+            on_progress(i, None)
+            continue
+        if on_result is not None:
+            on_result(i, results[i])
+        on_progress(i, None)
+
+
+def process_pages(client, pages, settings, on_progress, on_result=None, tracer=None):
+    # Run pages on a bounded worker pool as soon as they arrive; the stages of each page still run in order
+    tracer = tracer or Tracer()
+    events = queue.Queue()
+    cancelled = threading.Event()
+    futures = {}
+    results = {}
+    deferred = set()
+    dedup = None
+    if settings.get('dedup_hash_distance') is not None:
+        dedup = PageDeduplicator(settings['dedup_hash_distance'], settings['dedup_text_similarity'])
+
+    def report(i, message):
+        # Pages report at each stage boundary, which is also where a cancelled run stops spending on LLM calls
+        if cancelled.is_set():
+            raise CancelledError
+        events.put((i, message))
+
+    with ThreadPoolExecutor(max_workers=settings['max_workers']) as executor:
+        try:
+            for i, open_page, ocr_future in pages:
+                trace = partial(tracer.span, i + 1)
+                future = executor.submit(process_page, client, open_page, ocr_future, settings, partial(report, i),
+                                         trace, time.perf_counter(), page=i, dedup=dedup)
+                if dedup is not None:
+                    future.add_done_callback(partial(dedup.resolve, i))
+                futures[future] = i
+                relay_progress(futures, events, results, deferred, on_progress, on_result, timeout=0)
+            while len(results) + len(deferred) < len(futures):
+                relay_progress(futures, events, results, deferred, on_progress, on_result, timeout=0.1)
+        except BaseException:
+            # E.g. a Streamlit rerun or Ctrl+C: drop queued pages and stop running ones at their next stage
+            cancelled.set()
+            for future in futures:
+                future.cancel()
+            raise
+
+    return results
+
+
+def collect_extracts(results):
+    # Collect page results in page order; table_extracts is keyed by one-based page number
+    text_extracts = [results[i]['text_extract'] for i in sorted(results)]
+    formatted_tables = [results[i]['formatted_table'] for i in sorted(results)]
+    table_extracts = {i + 1: results[i]['tables'] for i in sorted(results) if results[i]['tables'] is not None}
+    return text_extracts, formatted_tables, table_extracts
+
+
+def save_results(results, page_count):
+    # Keep finished pages in session state as they arrive, so they survive a stop or rerun
+    text_extracts, formatted_tables, table_extracts = collect_extracts(results)
+    skipped_pages = [i + 1 for i in sorted(results) if results[i]['skipped'] and 'duplicate' not in results[i]]
+    st.session_state['page_results'] = results
+    st.session_state['pages_processed'] = (len(results), page_count)
+    st.session_state['table_detection_report'] = {
+        'skipped_pages': skipped_pages,
+        'calls_avoided': 2 * len(skipped_pages)
+    }
+    st.session_state['dedup_report'] = [results[i]['duplicate'] for i in sorted(results) if 'duplicate' in results[i]]
+    st.session_state['text_extracts'] = text_extracts
+    st.session_state['formatted_tables'] = formatted_tables
+    st.session_state['table_extracts'] = table_extracts
+    st.session_state['text_extracts_digest'] = digest_extracts(text_extracts)
+    st.session_state['table_extracts_digest'] = digest_extracts(table_extracts)
+
+
+def show_page_tables(page, tables):
+    if tables:
+        with st.expander(f'Page {page}: {len(tables)} table(s)'):
+            for table in tables:
+                st.caption(table['title'])
+                st.dataframe(table['content'], hide_index=True)
+
+
+def show_excel_download(label, **kwargs):
+    raw_file_name = st.session_state['file_name']
+    st.download_button(
+        label=label,
+        data=partial(build_export, st.session_state['table_extracts_digest'], 'xlsx',
+                     st.session_state['table_extracts']),
+        file_name=raw_file_name[:raw_file_name.rfind('.')] + '.xlsx',
+        mime=EXPORT_FORMATS['xlsx']['mime'],
+        type='primary',
+        **kwargs
+    )
 
 
-def process_uploaded_pdf(client):
+def process_uploaded_pdf(client, resume=False):
     uploaded_file = st.session_state['uploaded_pdf']
 
     if uploaded_file is not None:
         st.session_state['file_name'] = uploaded_file.name
 
+        # Resuming keeps the pages finished before processing was stopped
+        results = dict(st.session_state['page_results']) if resume else {}
+        download_slot = st.empty()
+
         with st.status('Scanning uploaded PDF pages ...', expanded=True) as status:
-            # Convert PDF pages into images
-            images = convert_from_bytes(uploaded_file.getvalue(), fmt='png', thread_count=8)
-            images = images[:min(st.secrets['PDF_PAGE_LIMIT'], len(images))]  # limit pages for cost reasons
-            st.session_state['images'] = images
-
-            # Read PDF using LlamaParse
-            status.update(label='Reading pages using LlamaParse ...', expanded=True)
-            parsed_documents = read_files_using_llama_parse(uploaded_file)
-
-            # Extract table titles from images
-            text_extracts = []
-            formatted_tables = []
-            table_extracts = {}
-            for i, image in enumerate(images):
-                # Create an empty holder to show page level details
-                status.update(label=f'Processing page {i + 1} ...', expanded=True)
-                placeholder = st.empty()
-
-                # Convert to string using OCR
-                placeholder.write('Scanning page using OCR ...')
-                ocr_string = parsed_documents[i].text
-
-                # Use OpenAI to extract Markdown text content from image
-                placeholder.write('Transcribing content using AI vision ...')
-                text_from_image = extract_tables_from_image(client, image, ocr_string)
-                text_extracts.append(text_from_image)
-
-                # Format Markdown tables properly
-                placeholder.write('Extracting tables using AI ...')
-                formatted_table = format_markdown_tables(client, text_from_image, image)
-                formatted_tables.append(formatted_table)
-
-                # Use OpenAI to convert Markdown to JSON
-                if 'NO_TABLE_PRESENT' not in formatted_table:
-                    placeholder.write('Converting tables into Excel ...')
-                    table_json = convert_markdown_to_json(client, formatted_table)
-                    table_extracts[i + 1] = table_json['tables']
-
-                # Empty placeholder at the end of processing each page
-                placeholder.empty()
-
-            # Update status and session states
+            # Only render the pages to be processed, limiting pages for cost reasons
+            settings = load_settings()
+            pdf_bytes = uploaded_file.getvalue()
+            page_count = min(st.secrets['PDF_PAGE_LIMIT'], count_pages(pdf_bytes))
+            remaining = [i for i in range(page_count) if i not in results]
+            save_results(results, page_count)
+
+            # Stopping reruns the script, which interrupts processing; finished pages are kept
+            st.button('Stop processing', key='stop_processing')
+
+            # Create an empty holder per page to show page level details, then the page's tables once done
+            status.update(label=f'Processing {len(remaining)} pages ...', expanded=True)
+            placeholders = {i: st.empty() for i in remaining}
+            tracer = Tracer()
+            st.session_state['performance_trace'] = tracer
+
+            def show_progress(i, message):
+                if message is None:
+                    status.update(label=f'Processed {len(results)} of {page_count} pages ...', expanded=True)
+                else:
+                    placeholders[i].write(f'Page {i + 1}: {message}')
+
+            def show_result(i, result):
+                results[i] = result
+                save_results(results, page_count)
+                with placeholders[i].container():
+                    show_page_tables(i + 1, result['tables'])
+
+                # The partial download must not rerun the script, which would stop processing
+                if st.session_state['table_extracts']:
+                    with download_slot:
+                        show_excel_download(f'Download Excel ({len(results)} of {page_count} pages done)',
+                                            on_click='ignore', key=f'partial_download_{len(results)}')
+
+            # Start OCR on the document, e.g. LlamaParse in the background or Tesseract as pages render
+            ocr_engine = create_ocr_engine(
+                settings['ocr_engine'],
+                llama_cloud_api_key=st.secrets.get('LLAMA_CLOUD_API_KEY'),
+                max_workers=settings['max_workers']
+            )
+
+            # Pages are only read while processing, so give their room in the shared page store back right after,
+            # also when processing is stopped; resuming renders the remaining pages again
+            page_handle = PageHandle(get_default_store())
+            try:
+                with ocr_engine:
+                    ocr_engine.start(pdf_bytes, uploaded_file.name)
+
+                    def iter_pages():
+                        # Convert PDF pages into images lazily, so early pages are processed while later ones render
+                        # Pages live in the shared page store, so only a bounded number are held in memory
+                        for i in store_page_images(page_handle, pdf_bytes, remaining,
+                                                   dpi=settings['image_policy']['dpi']):
+                            open_page = partial(page_handle.open, i)
+                            yield i, open_page, ocr_engine.submit(i, open_page)
+
+                    # Extract tables from pages concurrently, using the OCR text as reference
+                    process_pages(client, iter_pages(), settings, show_progress, on_result=show_result, tracer=tracer)
+            finally:
+                page_handle.release()
+
+            # Report the AI vision calls avoided by the table pre-pass
+            skipped_pages = st.session_state['table_detection_report']['skipped_pages']
+            if skipped_pages:
+                st.write(f'No tables detected on {len(skipped_pages)} pages, '
+                         f'avoided {2 * len(skipped_pages)} AI vision calls')
+
+            # Report which pages reused the results of an earlier near-identical page
+            dedup_report = st.session_state['dedup_report']
+            if dedup_report:
+                st.write(f'{len(dedup_report)} pages repeat earlier pages and reused their results')
+                st.dataframe(dedup_report, hide_index=True)
+
+            # Update status
             status.update(label='✅ PDF processing complete', expanded=False)
-            st.session_state['text_extracts'] = text_extracts
-            st.session_state['formatted_tables'] = formatted_tables
-            st.session_state['table_extracts'] = table_extracts
     else:
         st.session_state.pop('file_name', None)
+        st.session_state.pop('page_results', None)
+        st.session_state.pop('pages_processed', None)
         st.session_state.pop('text_extracts', None)
         st.session_state.pop('formatted_tables', None)
         st.session_state.pop('table_extracts', None)
+        st.session_state.pop('table_detection_report', None)
+        st.session_state.pop('dedup_report', None)
+        st.session_state.pop('text_extracts_digest', None)
+        st.session_state.pop('table_extracts_digest', None)
+        st.session_state.pop('performance_trace', None)
 
 
 if __name__ == '__main__':
     st.title('PDF ➡️ Excel')
 
-    # Initialize OpenAI Client
-    openai_client = OpenAI(api_key=st.secrets['OPENAI_API_KEY'])
+    # Show how often the LLM response cache saves a call
+    cache_stats = get_default_cache().stats()
+    st.sidebar.caption(f"LLM cache: {cache_stats['hits']} hits, {cache_stats['misses']} misses")
+    page_stats = get_default_store().stats()
+    st.sidebar.caption(f"Page store: {page_stats['memory_bytes'] / 2 ** 20:.0f} MB in memory, "
+                       f"{page_stats['spilled_pages']} pages on disk")
+    st.sidebar.toggle('Show performance details', key='show_performance')
+
+    # Share one pooled OpenAI client per server; the session id keeps rate limiting fair between users
+    session_id = st.session_state.setdefault('session_id', uuid.uuid4().hex)
+    openai_client = get_session_client(st.secrets['OPENAI_API_KEY'], session_id)
 
     # Upload scanned PDF for processing
     uploaded_pdf = st.file_uploader(
@@ -260,14 +487,21 @@ if __name__ == '__main__':
     if 'table_extracts' in st.session_state:
         st.divider()
 
+        # Processing stops when the user stops it, or when any other interaction reruns the script
+        pages_done, page_count = st.session_state['pages_processed']
+        if pages_done < page_count:
+            st.warning(f'Processing stopped after {pages_done} of {page_count} pages. '
+                       'The downloads below contain the finished pages.')
+            st.button('Process remaining pages', on_click=process_uploaded_pdf, args=(openai_client, True))
+
         if len(st.session_state['table_extracts']) > 0:
             # Set file names
             raw_file_name = st.session_state['file_name']
-            excel_file_name = raw_file_name[:raw_file_name.rfind('.')] + '.xlsx'
-            markdown_file_name = raw_file_name[:raw_file_name.rfind('.')] + '.md'
+            base_file_name = raw_file_name[:raw_file_name.rfind('.')]
 
-            # Build Excel and Markdown outputs
-            excel_workbook = create_excel_binary_from_json(st.session_state['table_extracts'])
+            # Excel and Markdown outputs are built only when a download is clicked, and memoized
+            table_digest = st.session_state['table_extracts_digest']
+            text_digest = st.session_state['text_extracts_digest']
 
             # Articulate how users can use the product
             download_description = """
@@ -277,19 +511,42 @@ if __name__ == '__main__':
             st.write(download_description)
 
             # Add download buttons
-            st.download_button(
-                label='Download Excel',
-                data=excel_workbook,
-                file_name=excel_file_name,
-                mime='application/vnd.ms-excel',
-                type='primary'
-            )
+            show_excel_download('Download Excel')
 
             st.download_button(
                 label='Download Transcription',
-                data='\n\n'.join(st.session_state['text_extracts']).encode('utf-8'),
-                file_name=markdown_file_name,
+                data=partial(build_transcription, text_digest, st.session_state['text_extracts']),
+                file_name=base_file_name + '.md',
                 mime='text/markdown'
             )
-        else:
+
+            # Offer the tables in other formats through the same memoized path
+            for export_format in ['csv', 'parquet']:
+                st.download_button(
+                    label=f"Download {EXPORT_FORMATS[export_format]['label']}",
+                    data=partial(build_export, table_digest, export_format, st.session_state['table_extracts']),
+                    file_name=f'{base_file_name}.{export_format}',
+                    mime=EXPORT_FORMATS[export_format]['mime'],
+                    type='tertiary'
+                )
+
+            # Show the extracted tables page by page
+            for page, tables in st.session_state['table_extracts'].items():
+                show_page_tables(page, tables)
+        elif pages_done == page_count:
             st.write('No tables are found in the uploaded PDF.')
+
+    # Show where time and tokens went for the last upload
+    if st.session_state.get('show_performance') and 'performance_trace' in st.session_state:
+        performance_trace = st.session_state['performance_trace']
+        st.divider()
+        st.subheader('Performance by stage')
+        st.dataframe(performance_trace.summary(), hide_index=True)
+
+        col1, col2 = st.columns(2)
+        with col1:
+            st.download_button('Download JSON trace', data=performance_trace.to_json, file_name='trace.json',
+                               mime='application/json')
+        with col2:
+            st.download_button('Download Prometheus metrics', data=performance_trace.to_prometheus,
+                               file_name='metrics.prom', mime='text/plain')
@@ -0,0 +1,219 @@
+import json
+import os
+import shutil
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+from openai.types.chat import ChatCompletion
+
+from llm_cache import LLMCache, request_payload
+from openai_pool import RateLimitedClient, get_rate_limiter
+
+# Limits of one OpenAI batch input file
+MAX_BATCH_REQUESTS = 50000
+MAX_BATCH_BYTES = 190 * 1024 * 1024
+
+TERMINAL_STATUSES = {'completed', 'failed', 'expired', 'cancelled'}
+
+
+class DeferredRequest(Exception):
+    # Raised instead of waiting for a completion that will come from a later batch
+    pass
+
+
+class BatchRequestError(Exception):
+    pass
+
+
+def request_key(request):
+    # The LLM cache key of the request, which also identifies it in batch files
+    return LLMCache.make_key(request_payload(request))
+
+
+class BatchBackend:
+    # Runs JSONL files of chat completion requests in the OpenAI batch format; poll returns None until the batch
+    # is done, then its output and error lines
+    def submit(self, path):
+        raise NotImplementedError
+
+    def poll(self, batch_id):
+        raise NotImplementedError
+
+
+class OpenAIBatchBackend(BatchBackend):
+    def __init__(self, client, completion_window='24h'):
+        self.client = client
+        self.completion_window = completion_window
+
+    def submit(self, path):
+        with open(path, 'rb') as f:
+            input_file = self.client.files.create(file=f, purpose='batch')
+        batch = self.client.batches.create(
+            input_file_id=input_file.id,
+            endpoint='/v1/chat/completions',
+            completion_window=self.completion_window
+        )
+        return batch.id
+
+    def poll(self, batch_id):
+        batch = self.client.batches.retrieve(batch_id)
+        if batch.status not in TERMINAL_STATUSES:
+            return None
+        if batch.status == 'failed':
+            raise RuntimeError(f'Batch {batch_id} failed: {batch.errors}')
+
+        # Expired or cancelled batches return what finished; the other requests are deferred again
+        lines = []
+        for file_id in [batch.output_file_id, batch.error_file_id]:
+            if file_id is not None:
+                lines += [json.loads(line) for line in self.client.files.content(file_id).text.splitlines() if line]
+        return lines
+
+
+class LocalBatchBackend(BatchBackend):
+    # Stand-in for the Batch API that works through each file in the background with ordinary requests,
+    # keeping the input and output files in a directory
+    def __init__(self, client, directory, max_workers=8):
+        self.client = client
+        self.directory = directory
+        self.max_workers = max_workers
+
+    def submit(self, path):
+        batch_id = f'local-batch-{uuid.uuid4().hex}'
+        batch_dir = os.path.join(self.directory, batch_id)
+        os.makedirs(batch_dir)
+        shutil.copyfile(path, os.path.join(batch_dir, 'input.jsonl'))
+        threading.Thread(target=self._run, args=(batch_dir,), daemon=True).start()
+        return batch_id
+
+    def _complete(self, line):
+        try:
+            completion = self.client.chat.completions.create(**line['body'])
+        except Exception as e:
+            return {'custom_id': line['custom_id'], 'response': None,
+                    'error': {'code': type(e).__name__, 'message': str(e)}}
+        return {'custom_id': line['custom_id'], 'response': {'status_code': 200, 'body': completion.model_dump()},
+                'error': None}
+
+    def _write(self, batch_dir, name, text):
+        # Files appear all at once, like the results of a finished batch
+        temp_path = os.path.join(batch_dir, name + '.tmp')
+        with open(temp_path, 'w') as f:
+            f.write(text)
+        os.replace(temp_path, os.path.join(batch_dir, name))
+
+    def _run(self, batch_dir):
+        try:
+            with open(os.path.join(batch_dir, 'input.jsonl')) as f:
+                lines = [json.loads(line) for line in f if line.strip()]
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                outputs = list(executor.map(self._complete, lines))
+            self._write(batch_dir, 'output.jsonl', ''.join(json.dumps(output) + '\n' for output in outputs))
+        except Exception as e:
+            # Fail the batch, like the Batch API does, rather than leave it running forever
+            self._write(batch_dir, 'error.txt', repr(e))
+
+    def poll(self, batch_id):
+        error_path = os.path.join(self.directory, batch_id, 'error.txt')
+        if os.path.exists(error_path):
+            with open(error_path) as f:
+                raise RuntimeError(f'Batch {batch_id} failed: {f.read()}')
+        path = os.path.join(self.directory, batch_id, 'output.jsonl')
+        if not os.path.exists(path):
+            return None
+        with open(path) as f:
+            return [json.loads(line) for line in f if line.strip()]
+
+
+BATCH_BACKENDS = {
+    'openai': lambda client, directory: OpenAIBatchBackend(client),
+    'local': lambda client, directory: LocalBatchBackend(
+        RateLimitedClient(client, get_rate_limiter(), 'local-batch'), directory
+    )
+}
+
+
+def create_batch_backend(name, client, directory):
+    if name not in BATCH_BACKENDS:
+        raise ValueError(f'Unknown batch backend: {name}')
+    return BATCH_BACKENDS[name](client, directory)
+
+
+def write_batch_files(requests, directory):
+    # Split the requests into JSONL files within the per-batch request and size limits
+    os.makedirs(directory, exist_ok=True)
+    paths = []
+    f = None
+    for key, request in requests.items():
+        line = json.dumps({'custom_id': key, 'method': 'POST', 'url': '/v1/chat/completions', 'body': request}) + '\n'
+        if f is None or count == MAX_BATCH_REQUESTS or size + len(line) > MAX_BATCH_BYTES:
+            if f is not None:
+                f.close()
+            paths.append(os.path.join(directory, f'requests-{uuid.uuid4().hex}.jsonl'))
+            f = open(paths[-1], 'w')
+            count = size = 0
+        f.write(line)
+        count += 1
+        size += len(line)
+    if f is not None:
+        f.close()
+    return paths
+
+
+def run_batch(backend, requests, directory, poll_interval=30):
+    # Submit the requests, wait for every batch and return each request's response body or error by key
+    batch_ids = [backend.submit(path) for path in write_batch_files(requests, directory)]
+    print(f'Submitted {len(requests)} requests in {len(batch_ids)} batches', flush=True)
+    results = {}
+    while batch_ids:
+        time.sleep(poll_interval)
+        for batch_id in list(batch_ids):
+            lines = backend.poll(batch_id)
+            if lines is None:
+                continue
+            batch_ids.remove(batch_id)
+            for line in lines:
+                response = line.get('response')
+                if response is not None and response['status_code'] == 200:
+                    results[line['custom_id']] = {'body': response['body']}
+                else:
+                    results[line['custom_id']] = {'error': line.get('error') or response}
+            print(f'Batch {batch_id} done, {len(batch_ids)} still running', flush=True)
+    return results
+
+
+class DeferredClient:
+    # Looks like an OpenAI client to the stage functions: answers requests from finished batches, and defers the
+    # rest, which stops the page at that stage until the next round
+    def __init__(self, results):
+        self.results = results
+        self.pending = {}
+        self._lock = threading.Lock()
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create_chat_completion))
+
+    def create_chat_completion(self, **request):
+        key = request_key(request)
+        if key not in self.results:
+            with self._lock:
+                self.pending[key] = request
+            raise DeferredRequest(key)
+        if 'error' in self.results[key]:
+            raise BatchRequestError(self.results[key]['error'])
+        return ChatCompletion.model_validate(self.results[key]['body'])
+
+
+def run_deferred(run, backend, directory, poll_interval=30, max_rounds=8):
+    # Run the whole workload with deferred requests, batch what it asked for, and run it again with the answers,
+    # until nothing is deferred; each round gets as far as the answers so far allow, e.g. one more stage per page
+    results = {}
+    for round_number in range(1, max_rounds + 1):
+        client = DeferredClient(results)
+        outcome = run(client)
+        if not client.pending:
+            return outcome
+        print(f'Round {round_number}: {len(client.pending)} requests deferred', flush=True)
+        results.update(run_batch(backend, client.pending, directory, poll_interval))
+    raise RuntimeError(f'Requests were still deferred after {max_rounds} rounds, rerun to resume')
@@ -0,0 +1,51 @@
+import json
+import os
+
+
+def find_pdfs(source):
+    # Accept a directory of PDFs, or a manifest listing one PDF path per line
+    if os.path.isdir(source):
+        return sorted(os.path.join(source, name) for name in os.listdir(source) if name.lower().endswith('.pdf'))
+    base_dir = os.path.dirname(os.path.abspath(source))
+    with open(source) as f:
+        lines = [line.strip() for line in f]
+    return [os.path.join(base_dir, line) for line in lines if line and not line.startswith('#')]
+
+
+class PageCheckpoints:
+    # One JSON file per finished page, written atomically so a crash never leaves a partial checkpoint
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, page):
+        return os.path.join(self.directory, f'page-{page + 1:04d}.json')
+
+    def load(self):
+        results = {}
+        for name in os.listdir(self.directory):
+            if name.startswith('page-') and name.endswith('.json'):
+                with open(os.path.join(self.directory, name)) as f:
+                    results[int(name[len('page-'):-len('.json')]) - 1] = json.load(f)
+        return results
+
+    def save(self, page, result):
+        temp_path = self.path(page) + '.tmp'
+        with open(temp_path, 'w') as f:
+            json.dump(result, f)
+        os.replace(temp_path, self.path(page))
+
+    def ocr_path(self, page):
+        return os.path.join(self.directory, f'ocr-{page + 1:04d}.txt')
+
+    def load_ocr(self, page):
+        if not os.path.exists(self.ocr_path(page)):
+            return None
+        with open(self.ocr_path(page), encoding='utf-8') as f:
+            return f.read()
+
+    def save_ocr(self, page, text):
+        temp_path = self.ocr_path(page) + '.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            f.write(text)
+        os.replace(temp_path, self.ocr_path(page))
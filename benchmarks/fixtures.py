@@ -0,0 +1,81 @@
+import random
+
+from PIL import Image, ImageDraw
+
+# Synthetic pages are US Letter at a low resolution, which keeps 200-page fixtures small
+PAGE_SIZE = (850, 1100)
+MARGIN = 60
+LINE_HEIGHT = 22
+
+WORDS = ['revenue', 'expenses', 'assets', 'liabilities', 'equity', 'operations', 'quarter', 'fiscal', 'statement',
+         'consolidated', 'total', 'net', 'income', 'cash', 'flows', 'period', 'ended', 'notes', 'financial', 'report']
+ROW_LABELS = ['Revenue', 'Cost of sales', 'Gross profit', 'Operating expenses', 'Operating income', 'Net income']
+
+
+def page_content(i):
+    # Deterministic content for page i: narrative paragraphs, and a table on every other page
+    rng = random.Random(i)
+    title = f'Section {i + 1}: ' + ' '.join(rng.choice(WORDS) for _ in range(3)).title()
+    paragraphs = [' '.join(rng.choice(WORDS) for _ in range(rng.randint(40, 80))) for _ in range(rng.randint(2, 4))]
+    table = None
+    if i % 2 == 1:
+        table = [['Item', '2023', '2022']]
+        table += [[label, f'{rng.randint(100, 9999):,}', f'{rng.randint(100, 9999):,}'] for label in ROW_LABELS]
+    return title, paragraphs, table
+
+
+def page_markdown(i):
+    # What an OCR engine returning Markdown would produce for page i
+    title, paragraphs, table = page_content(i)
+    lines = [f'# {title}', ''] + [paragraph + '\n' for paragraph in paragraphs]
+    if table is not None:
+        lines.append('| ' + ' | '.join(table[0]) + ' |')
+        lines.append('|' + '---|' * len(table[0]))
+        lines += ['| ' + ' | '.join(row) + ' |' for row in table[1:]]
+    return '\n'.join(lines)
+
+
+def wrap_words(text, width):
+    lines = []
+    line = ''
+    for word in text.split():
+        if len(line) + len(word) + 1 > width:
+            lines.append(line)
+            line = word
+        else:
+            line = f'{line} {word}'.strip()
+    return lines + [line]
+
+
+def render_page(i):
+    title, paragraphs, table = page_content(i)
+    image = Image.new('L', PAGE_SIZE, 255)
+    draw = ImageDraw.Draw(image)
+    y = MARGIN
+    draw.text((MARGIN, y), title, fill=0)
+    y += 2 * LINE_HEIGHT
+    for paragraph in paragraphs:
+        for line in wrap_words(paragraph, 110):
+            draw.text((MARGIN, y), line, fill=0)
+            y += LINE_HEIGHT
+        y += LINE_HEIGHT
+
+    # Draw bordered tables, so the ruling-line detector sees them too
+    if table is not None:
+        column_width = (PAGE_SIZE[0] - 2 * MARGIN) // len(table[0])
+        top = y
+        for row in table:
+            draw.line([(MARGIN, y), (PAGE_SIZE[0] - MARGIN, y)], fill=0, width=2)
+            for column, cell in enumerate(row):
+                draw.text((MARGIN + column * column_width + 8, y + 5), cell, fill=0)
+            y += LINE_HEIGHT + 6
+        draw.line([(MARGIN, y), (PAGE_SIZE[0] - MARGIN, y)], fill=0, width=2)
+        for column in range(len(table[0]) + 1):
+            x = MARGIN + column * column_width
+            draw.line([(x, top), (x, y)], fill=0, width=2)
+    return image
+
+
+def write_fixture_pdf(path, pages):
+    images = [render_page(i) for i in range(pages)]
+    images[0].save(path, format='PDF', save_all=True, append_images=images[1:], resolution=100)
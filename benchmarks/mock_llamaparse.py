@@ -0,0 +1,22 @@
+import random
+import time
+from types import SimpleNamespace
+
+from pdf2image import pdfinfo_from_bytes
+
+from benchmarks.fixtures import page_markdown
+from benchmarks.mock_openai import parse_latency
+
+
+class MockLlamaParse:
+    # Stands in for the LlamaParse client: waits like a remote parse job, then returns the fixture Markdown per page
+    def __init__(self, api_key=None, result_type='markdown', verbose=False, latency='fixed:3000',
+                 page_latency='fixed:50', seed=0):
+        self.latency = parse_latency(latency)
+        self.page_latency = parse_latency(page_latency)
+        self._rng = random.Random(seed)
+
+    def load_data(self, file, extra_info=None):
+        pages = pdfinfo_from_bytes(file.read())['Pages']
+        time.sleep(self.latency(self._rng) + sum(self.page_latency(self._rng) for _ in range(pages)))
+        return [SimpleNamespace(text=page_markdown(i), metadata=dict(extra_info or {})) for i in range(pages)]
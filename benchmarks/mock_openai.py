@@ -0,0 +1,154 @@
+import argparse
+import json
+import os
+import random
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+RECORDINGS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'recordings.json')
+
+
+def parse_latency(spec):
+    # 'fixed:500', 'uniform:200,1200' or 'lognormal:800,0.5' (median and sigma), all in milliseconds
+    kind, _, params = spec.partition(':')
+    values = [float(value) for value in params.split(',')] if params else []
+    if kind == 'fixed':
+        return lambda rng: values[0] / 1000
+    if kind == 'uniform':
+        return lambda rng: rng.uniform(values[0], values[1]) / 1000
+    if kind == 'lognormal':
+        return lambda rng: rng.lognormvariate(0, values[1]) * values[0] / 1000
+    raise ValueError(f'Unknown latency distribution: {spec}')
+
+
+def message_text(messages):
+    # Text of all message parts, leaving out the base64 images
+    texts = []
+    for message in messages:
+        if isinstance(message['content'], str):
+            texts.append(message['content'])
+        else:
+            texts += [part['text'] for part in message['content'] if part['type'] == 'text']
+    return '\n'.join(texts)
+
+
+class MockOpenAI:
+    # Replays recorded chat completions with configurable latency, errors and rate limits
+    def __init__(self, recordings, latency='fixed:0', error_rate=0.0, requests_per_minute=None, seed=0):
+        self.recordings = recordings
+        self.latency = parse_latency(latency)
+        self.error_rate = error_rate
+        self.requests_per_minute = requests_per_minute
+        self.stats = {'requests': 0, 'errors': 0, 'rate_limited': 0}
+        self._rng = random.Random(seed)
+        self._recent = deque()
+        self._lock = threading.Lock()
+
+    def _retry_after(self):
+        # Sliding one-minute window of accepted requests
+        with self._lock:
+            self.stats['requests'] += 1
+            now = time.monotonic()
+            while self._recent and self._recent[0] <= now - 60:
+                self._recent.popleft()
+            if self.requests_per_minute is not None and len(self._recent) >= self.requests_per_minute:
+                self.stats['rate_limited'] += 1
+                return self._recent[0] + 60 - now
+            self._recent.append(now)
+            return None
+
+    def respond(self, body):
+        retry_after = self._retry_after()
+        if retry_after is not None:
+            error = {'message': 'Rate limit reached for requests', 'type': 'requests', 'code': 'rate_limit_exceeded'}
+            return 429, {'Retry-After': f'{retry_after:.3f}'}, {'error': error}
+
+        with self._lock:
+            delay = self.latency(self._rng)
+            failed = self._rng.random() < self.error_rate
+        time.sleep(delay)
+        if failed:
+            with self._lock:
+                self.stats['errors'] += 1
+            return 500, {}, {'error': {'message': 'The server had an error', 'type': 'server_error', 'code': None}}
+
+        text = message_text(body['messages'])
+        content = next((recording['content'] for recording in self.recordings if recording['match'] in text),
+                       'NO_TABLE_PRESENT')
+        # Count images by part like the API does, rather than by the length of their base64 data
+        images = sum(1 for message in body['messages'] if not isinstance(message['content'], str)
+                     for part in message['content'] if part['type'] == 'image_url')
+        prompt_tokens = len(text) // 4 + 765 * images
+        completion_tokens = len(content) // 4
+        return 200, {}, {
+            'id': f'chatcmpl-mock-{self.stats["requests"]}',
+            'object': 'chat.completion',
+            'created': int(time.time()),
+            'model': body['model'],
+            'choices': [{
+                'index': 0,
+                'message': {'role': 'assistant', 'content': content},
+                'finish_reason': 'stop',
+                'logprobs': None
+            }],
+            'usage': {
+                'prompt_tokens': prompt_tokens,
+                'completion_tokens': completion_tokens,
+                'total_tokens': prompt_tokens + completion_tokens
+            }
+        }
+
+
+class MockOpenAIHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        if self.path.rstrip('/') != '/v1/chat/completions':
+            self.send_error(404)
+            return
+        body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        status, headers, payload = self.server.mock.respond(body)
+        data = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def load_recordings(path=RECORDINGS_PATH):
+    with open(path) as f:
+        return json.load(f)
+
+
+def start_server(mock, host='127.0.0.1', port=0):
+    # Serve in a background thread; returns the server and the base URL for the OpenAI client
+    server = ThreadingHTTPServer((host, port), MockOpenAIHandler)
+    server.daemon_threads = True
+    server.mock = mock
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f'http://{host}:{server.server_address[1]}/v1'
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Serve recorded OpenAI chat completions locally, '
+                                                 'e.g. for the apps with OPENAI_BASE_URL=http://127.0.0.1:8000/v1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--recordings', default=RECORDINGS_PATH)
+    parser.add_argument('--latency', default='lognormal:800,0.5')
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--requests-per-minute', type=int, default=None)
+    args = parser.parse_args()
+
+    mock_openai = MockOpenAI(load_recordings(args.recordings), args.latency, args.error_rate, args.requests_per_minute)
+    mock_server, base_url = start_server(mock_openai, port=args.port)
+    print(f'Serving recorded completions at {base_url}')
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        mock_server.shutdown()
@@ -0,0 +1,161 @@
+import argparse
+import json
+import multiprocessing
+import os
+import resource
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from types import SimpleNamespace
+
+from openai import OpenAI
+
+from CPP import PAGES, extract_form_values
+from benchmarks.fixtures import write_fixture_pdf
+from benchmarks.mock_llamaparse import MockLlamaParse
+from benchmarks.mock_openai import MockOpenAI, load_recordings, start_server
+from image_encoding import ENCODING_POLICIES
+from instrumentation import Tracer
+from ocr_engines import OCR_ENGINES, LlamaParseEngine
+from openai_pool import RateLimitedClient, get_rate_limiter
+from pdf2excel_batch import convert_document
+
+# Metrics where a higher value in the new run is a regression
+REGRESSION_METRICS = ['latency_seconds', 'peak_rss_mb', 'cpu_seconds']
+
+
+def resource_usage():
+    # CPU time and peak RSS of this process, including the pdftoppm and Tesseract subprocesses it ran
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return {
+        'cpu_seconds': own.ru_utime + own.ru_stime + children.ru_utime + children.ru_stime,
+        'peak_rss_mb': max(own.ru_maxrss, children.ru_maxrss) / 1024
+    }
+
+
+def run_pdf2excel(base_url, pdf_path, options):
+    # Retries happen in the rate-limited wrapper that convert_document puts around the client
+    client = OpenAI(base_url=base_url, api_key='mock', max_retries=0)
+    mock_llamaparse = partial(MockLlamaParse, latency=options['llamaparse_latency'])
+    OCR_ENGINES['llamaparse-replay'] = lambda api_key, max_workers: LlamaParseEngine(api_key, mock_llamaparse)
+    settings = {
+        'max_workers': options['workers'],
+        'image_policy': ENCODING_POLICIES[options['image_policy']],
+        'table_threshold': options['table_threshold'],
+        'ocr_engine': 'llamaparse-replay',
+        'dedup_hash_distance': 6,
+        'dedup_text_similarity': 0.9,
+        'table_cropping': options['table_cropping']
+    }
+
+    tracer = Tracer()
+    with tempfile.TemporaryDirectory(prefix='benchmark-') as work_dir:
+        args = SimpleNamespace(checkpoint_dir=work_dir, output_dir=work_dir, page_limit=None)
+        start = time.perf_counter()
+        summary = convert_document(client, pdf_path, settings, tracer, args)
+        latency = time.perf_counter() - start
+
+    llm_calls = sum(stage['llm_calls'] for stage in tracer.summary())
+    return {'pages': summary['pages'], 'latency_seconds': latency, 'llm_calls': llm_calls, **resource_usage()}
+
+
+def run_cpp(base_url, pdf_path, options):
+    # Runs the same extraction as CPP.process_uploaded_pdf
+    client = RateLimitedClient(OpenAI(base_url=base_url, api_key='mock', max_retries=0), get_rate_limiter(), 'cpp')
+    image_policy = ENCODING_POLICIES[options['image_policy']]
+    with open(pdf_path, 'rb') as f:
+        pdf_bytes = f.read()
+
+    tracer = Tracer()
+    start = time.perf_counter()
+    extract_form_values(client, pdf_bytes, image_policy, tracer)
+    latency = time.perf_counter() - start
+
+    # Counts re-asks, and leaves out cache hits
+    llm_calls = sum(stage['llm_calls'] for stage in tracer.summary())
+    return {'pages': len(PAGES), 'latency_seconds': latency, 'llm_calls': llm_calls, **resource_usage()}
+
+
+def run_scenario(name, runner, pdf_path, options):
+    # Each scenario gets its own mock server, LLM cache and process, so runs do not warm each other up
+    mock = MockOpenAI(load_recordings(), options['latency'], options['error_rate'], options['requests_per_minute'])
+    server, base_url = start_server(mock)
+    with tempfile.TemporaryDirectory(prefix='benchmark-cache-') as cache_dir:
+        os.environ['LLM_CACHE_DIR'] = cache_dir
+        try:
+            with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as executor:
+                result = executor.submit(runner, base_url, pdf_path, options).result()
+        finally:
+            server.shutdown()
+    result['pages_per_second'] = result['pages'] / result['latency_seconds']
+    return {'scenario': name, **result, **{f'server_{key}': value for key, value in mock.stats.items()}}
+
+
+def find_regressions(results, baseline, tolerance):
+    regressions = []
+    for result in results:
+        previous = baseline.get(result['scenario'])
+        if previous is None:
+            continue
+        for metric in REGRESSION_METRICS:
+            if result[metric] > previous[metric] * (1 + tolerance):
+                regressions.append(f"{result['scenario']}: {metric} {previous[metric]:.2f} -> {result[metric]:.2f}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark both apps against local OpenAI and LlamaParse stand-ins')
+    parser.add_argument('--pages', type=int, nargs='+', default=[1, 10, 50], help='PDF2EXCEL fixture sizes (1-200)')
+    parser.add_argument('--skip-cpp', action='store_true')
+    parser.add_argument('--latency', default='lognormal:800,0.5', help='OpenAI latency, e.g. fixed:500')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='share of OpenAI requests failing with 500')
+    parser.add_argument('--requests-per-minute', type=int, default=None, help='answer 429 above this rate')
+    parser.add_argument('--llamaparse-latency', default='fixed:3000')
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--image-policy', default='lossless', choices=sorted(ENCODING_POLICIES))
+    parser.add_argument('--table-threshold', type=float, default=0.5)
+    parser.add_argument('--table-cropping', action='store_true')
+    parser.add_argument('--output', default=None, help='write results as JSON, usable as a later --baseline')
+    parser.add_argument('--baseline', default=None, help='results JSON of an earlier run to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='allowed relative slowdown before failing')
+    args = parser.parse_args()
+    options = vars(args)
+
+    results = []
+    with tempfile.TemporaryDirectory(prefix='benchmark-fixtures-') as fixture_dir:
+        scenarios = []
+        for pages in args.pages:
+            pdf_path = os.path.join(fixture_dir, f'report-{pages}.pdf')
+            write_fixture_pdf(pdf_path, pages)
+            scenarios.append((f'pdf2excel-{pages}p', run_pdf2excel, pdf_path))
+        if not args.skip_cpp:
+            pdf_path = os.path.join(fixture_dir, 'isp1000.pdf')
+            write_fixture_pdf(pdf_path, max(PAGES) + 1)
+            scenarios.append(('cpp-extraction', run_cpp, pdf_path))
+
+        for name, runner, pdf_path in scenarios:
+            result = run_scenario(name, runner, pdf_path, options)
+            results.append(result)
+            print(f"{name:<20}{result['latency_seconds']:>8.1f}s{result['pages_per_second']:>8.2f} pages/s"
+                  f"{result['peak_rss_mb']:>8.0f} MB RSS{result['cpu_seconds']:>8.1f}s CPU"
+                  f"{result['server_rate_limited']:>6} x 429", flush=True)
+
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            baseline = {result['scenario']: result for result in json.load(f)}
+        regressions = find_regressions(results, baseline, args.tolerance)
+        for regression in regressions:
+            print(f'REGRESSION {regression}')
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,160 @@
+import argparse
+import csv
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from itertools import islice
+
+from sqlite_store import SQLiteStore
+
+CONTRIBUTIONS_DB = os.environ.get('CONTRIBUTIONS_DB', os.path.join('.cache', 'contributions.sqlite3'))
+CONTRIBUTIONS_CACHE_SECONDS = float(os.environ.get('CONTRIBUTIONS_CACHE_SECONDS', 300))
+
+# One row per SIN and year; WITHOUT ROWID keeps the rows clustered on SIN, so a lookup reads one index range
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS contributions (
+    sin TEXT NOT NULL,
+    year INTEGER NOT NULL,
+    amount REAL NOT NULL,
+    PRIMARY KEY (sin, year)
+) WITHOUT ROWID;
+'''
+
+
+def normalize_sin(sin):
+    # Keep only the digits, so "123 456 789", "123-456-789" and 123456789 are the same key
+    return re.sub(r'\D', '', str(sin))
+
+
+class ContributionsProvider:
+    # Returns the total past CPP contributions of a SIN, or None when there is no record of it
+    def lookup(self, sin):
+        raise NotImplementedError
+
+    def lookup_many(self, sins):
+        return {normalize_sin(sin): self.lookup(sin) for sin in sins}
+
+
+class FixedContributions(ContributionsProvider):
+    # The same amount for every applicant, for demos without contribution data
+    def __init__(self, amount):
+        self.amount = amount
+
+    def lookup(self, sin):
+        return self.amount
+
+
+class SQLiteContributions(SQLiteStore, ContributionsProvider):
+    def __init__(self, path):
+        super().__init__(path, SCHEMA)
+
+    def lookup(self, sin):
+        row = self._connect().execute(
+            'SELECT COUNT(*), SUM(amount) FROM contributions WHERE sin = ?', (normalize_sin(sin),)
+        ).fetchone()
+        return row[1] if row[0] else None
+
+    def lookup_many(self, sins, batch_size=500):
+        # One query per batch of SINs instead of one per applicant
+        sins = sorted({normalize_sin(sin) for sin in sins})
+        totals = dict.fromkeys(sins)
+        for start in range(0, len(sins), batch_size):
+            batch = sins[start:start + batch_size]
+            totals.update(self._connect().execute(
+                f'SELECT sin, SUM(amount) FROM contributions WHERE sin IN ({", ".join("?" * len(batch))}) GROUP BY sin',
+                batch
+            ).fetchall())
+        return totals
+
+    def load(self, rows, batch_size=10000):
+        # Insert (sin, year, amount) rows in batches, replacing years that were loaded before
+        loaded = 0
+        rows = ((normalize_sin(sin), int(year), float(amount)) for sin, year, amount in rows)
+        while batch := list(islice(rows, batch_size)):
+            with self.transaction() as conn:
+                conn.executemany('INSERT OR REPLACE INTO contributions (sin, year, amount) VALUES (?, ?, ?)', batch)
+            loaded += len(batch)
+        return loaded
+
+    def stats(self):
+        people, years = self._connect().execute(
+            'SELECT COUNT(DISTINCT sin), COUNT(*) FROM contributions'
+        ).fetchone()
+        return {'people': people, 'years': years}
+
+
+class CachedContributions(ContributionsProvider):
+    # Keeps recent lookups in memory for a while, so reruns and repeat applicants skip the data source
+    def __init__(self, provider, ttl, max_entries=10000):
+        self.provider = provider
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def lookup(self, sin):
+        sin = normalize_sin(sin)
+        now = time.monotonic()
+        with self._lock:
+            if sin in self._entries and self._entries[sin][0] > now:
+                self._entries.move_to_end(sin)
+                return self._entries[sin][1]
+        amount = self.provider.lookup(sin)
+        with self._lock:
+            self._entries[sin] = (now + self.ttl, amount)
+            self._entries.move_to_end(sin)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return amount
+
+
+def total_contributions(provider, sin):
+    # Applicants without a record have made no contributions
+    return provider.lookup(sin) or 0.0
+
+
+_providers = {}
+_providers_lock = threading.Lock()
+
+
+def get_default_provider(fixed_amount=None):
+    # A fixed amount stands in for the data source in demos; otherwise read the local SQLite store
+    with _providers_lock:
+        if fixed_amount not in _providers:
+            if fixed_amount is not None:
+                provider = FixedContributions(fixed_amount)
+            else:
+                provider = SQLiteContributions(CONTRIBUTIONS_DB)
+            _providers[fixed_amount] = CachedContributions(provider, CONTRIBUTIONS_CACHE_SECONDS)
+        return _providers[fixed_amount]
+
+
+def read_history(path):
+    # Contribution history files are CSVs with sin, year and amount columns
+    with open(path, newline='') as f:
+        for row in csv.DictReader(f):
+            yield row['sin'], row['year'], row['amount']
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Load or look up CPP contribution histories')
+    parser.add_argument('--db', default=CONTRIBUTIONS_DB, help='SQLite file holding the contributions')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    load_parser = subparsers.add_parser('load', help='load CSV files with sin, year and amount columns')
+    load_parser.add_argument('paths', nargs='+')
+    lookup_parser = subparsers.add_parser('lookup', help='print the total contributions of a SIN')
+    lookup_parser.add_argument('sin')
+    subparsers.add_parser('stats', help='count the people and years loaded')
+    args = parser.parse_args()
+
+    store = SQLiteContributions(args.db)
+    if args.command == 'load':
+        for path in args.paths:
+            start = time.perf_counter()
+            print(f'{path}: {store.load(read_history(path))} rows in {time.perf_counter() - start:.1f}s')
+    elif args.command == 'lookup':
+        print(store.lookup(args.sin))
+    else:
+        print(store.stats())
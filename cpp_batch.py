@@ -0,0 +1,218 @@
+import argparse
+import hashlib
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from CPP import FIELDS_LIST, PAGE_PROMPTS, PAGE_SCHEMAS, extract_page_values
+from batch_backend import BATCH_BACKENDS, DeferredClient, DeferredRequest, create_batch_backend, run_deferred
+from batch_files import PageCheckpoints, find_pdfs
+from contributions import CONTRIBUTIONS_DB, FixedContributions, SQLiteContributions, normalize_sin
+from cpp_rules import age_eligibility, payment_scenarios
+from form_schema import validate_values
+from image_encoding import ENCODING_POLICIES
+from instrumentation import Tracer
+from openai_pool import RateLimitedClient, get_rate_limiter, get_shared_client
+
+# Blank answers to these fields leave the assessment without an input, so a caseworker has to look at them
+REVIEW_FIELDS = ['Social Insurance Number', 'Date of Birth', 'Pension Start']
+
+
+def extract_page(client, pdf_path, i, checkpoints, image_policy, tracer):
+    with open(pdf_path, 'rb') as f:
+        pdf_bytes = f.read()
+    with tempfile.TemporaryDirectory(prefix='cpp-batch-') as page_dir:
+        values = extract_page_values(client, pdf_bytes, i, page_dir, image_policy, tracer)
+    checkpoints.save(i, values)
+    return values
+
+
+def extract_forms(client, forms, args, image_policy, tracer):
+    # Pages of all forms share one bounded pool; forms share the rate limiter as separate sessions, unless the
+    # requests are deferred to batches
+    extracted_pages = 0
+    with ThreadPoolExecutor(max_workers=args.workers) as executor:
+        futures = {}
+        for path, form in forms.items():
+            form['errors'] = []
+            form_client = client
+            if not isinstance(client, DeferredClient):
+                form_client = RateLimitedClient(client, get_rate_limiter(), os.path.basename(path))
+            for i in PAGE_PROMPTS:
+                if i not in form['pages']:
+                    future = executor.submit(extract_page, form_client, path, i, form['checkpoints'], image_policy,
+                                             tracer)
+                    futures[future] = (path, i)
+        for future in as_completed(futures):
+            path, i = futures[future]
+            try:
+                forms[path]['pages'][i] = future.result()
+                extracted_pages += 1
+            except DeferredRequest:
+                # Left out until a later round brings the batch with its answer
+                pass
+            except Exception as e:
+                forms[path]['errors'].append(f'page {i + 1}: {e!r}')
+                print(f'{os.path.basename(path)}: page {i + 1} failed ({e!r}), rerun to resume', flush=True)
+    return extracted_pages
+
+
+def review_flags(pages):
+    # Answers that still do not match their type, options or format after the re-ask, and blanks the assessment needs
+    flags = []
+    for i, schema in PAGE_SCHEMAS.items():
+        flags += validate_values(pages[i], schema)[1]
+    values = {k: v for page in pages.values() for k, v in page.items()}
+    flags += [field_id for field_id in REVIEW_FIELDS if values.get(field_id) is None]
+    birth_date = values.get('Date of Birth')
+    if birth_date is not None and pd.isna(pd.to_datetime(birth_date, format='%Y-%m-%d', errors='coerce')):
+        flags.append('Date of Birth')
+    if values.get('Pension Start') == 'As of' and values.get('As of Date') is None:
+        flags.append('As of Date')
+    return sorted(set(flags), key=[field['ID'] for field in FIELDS_LIST].index)
+
+
+def build_frame(forms):
+    # One row per form, with the fields to review and why a form could not be assessed
+    rows = []
+    for path, form in forms.items():
+        row = {'File': os.path.basename(path)}
+        if form['errors']:
+            row.update({'Status': 'failed', 'Error': '; '.join(form['errors'])})
+        else:
+            flags = review_flags(form['pages'])
+            row.update({'Status': 'needs review' if flags else 'complete', 'Review fields': '; '.join(flags)})
+        for page in form['pages'].values():
+            row.update(page)
+        rows.append(row)
+
+    # Keep the answers as extracted; with blanks or failed forms in a column pandas would turn its ints into floats,
+    # e.g. a SIN of 123456789.0 that no longer matches its contributions
+    columns = ['File', 'Status', 'Error', 'Review fields'] + [field['ID'] for field in FIELDS_LIST]
+    return pd.DataFrame(rows, columns=columns, dtype=object).replace({np.nan: None})
+
+
+def assess_forms(frame, provider, today):
+    # Eligibility and payment for the whole batch at once, instead of form by form
+    birth_dates = pd.to_datetime(frame['Date of Birth'], format='%Y-%m-%d', errors='coerce')
+    start_dates = pd.to_datetime(frame['As of Date'], format='%Y-%m', errors='coerce')
+    as_soon_as_qualified = (frame['Pension Start'] == 'As soon as I qualify').to_numpy()
+    start_dates = start_dates.where(~as_soon_as_qualified, pd.Timestamp(today))
+
+    sins = frame['Social Insurance Number'].dropna().map(normalize_sin)
+    totals = provider.lookup_many(sins)
+    frame['Past contributions'] = sins.map(lambda sin: totals[sin] or 0.0).reindex(frame.index, fill_value=0.0)
+
+    known = birth_dates.notna().to_numpy()
+    frame['Age eligible'] = False
+    frame.loc[known, 'Age eligible'] = age_eligibility(birth_dates[known].to_numpy(), today)
+    frame['CPP eligible'] = frame['Age eligible'] & (frame['Past contributions'] > 0)
+
+    payable = (frame['CPP eligible'] & start_dates.notna()).to_numpy()
+    scenarios = payment_scenarios(birth_dates[payable].to_numpy(), start_dates[payable].to_numpy(),
+                                  frame.loc[payable, 'Past contributions'].to_numpy(), as_soon_as_qualified[payable])
+    frame['Pension start month'] = None
+    frame.loc[payable, 'Pension start month'] = scenarios['start_month'].astype(str)
+    frame.loc[payable, 'Months from 65'] = scenarios['delta_months']
+    frame.loc[payable, 'Adjustment (%)'] = scenarios['percentage_impact']
+    frame.loc[payable, 'Monthly payment'] = scenarios['payment'].round(2)
+    return frame
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Extract and assess many scanned CPP applications, headless')
+    parser.add_argument('source', help='directory of PDFs, or a manifest file with one PDF path per line')
+    parser.add_argument('--output', default='output/cpp_applications.csv', help='.csv or .parquet file to write')
+    parser.add_argument('--checkpoint-dir', default='.cache/cpp_checkpoints', help='where extracted pages are kept')
+    parser.add_argument('--workers', type=int, default=8, help='form pages extracted at the same time')
+    parser.add_argument('--image-policy', default='lossless', choices=sorted(ENCODING_POLICIES))
+    parser.add_argument('--contributions-db', default=CONTRIBUTIONS_DB, help='SQLite file of past contributions')
+    parser.add_argument('--contributions', type=float, default=None,
+                        help='use this total for every applicant instead of the contributions database')
+    parser.add_argument('--trace', default=None, help='write a JSON trace here, and Prometheus metrics next to it')
+    parser.add_argument('--deferred', action='store_true',
+                        help='send the LLM requests as batch jobs, which are slower but cheaper, and wait for them')
+    parser.add_argument('--batch-backend', default='openai', choices=sorted(BATCH_BACKENDS),
+                        help='the OpenAI Batch API, or a local stand-in that runs the batch files itself')
+    parser.add_argument('--batch-dir', default='.cache/batches', help='where batch request and result files are kept')
+    parser.add_argument('--batch-poll-interval', type=float, default=30, help='seconds between batch status checks')
+    args = parser.parse_args()
+
+    client = get_shared_client(os.environ['OPENAI_API_KEY'])
+    image_policy = ENCODING_POLICIES[args.image_policy]
+    pdf_paths = find_pdfs(args.source)
+
+    # Resume every form from the pages finished by earlier runs
+    start = time.perf_counter()
+    tracer = Tracer()
+    forms = {}
+    for path in pdf_paths:
+        with open(path, 'rb') as f:
+            checkpoints = PageCheckpoints(os.path.join(args.checkpoint_dir, hashlib.sha256(f.read()).hexdigest()))
+        pages = {i: values for i, values in checkpoints.load().items() if i in PAGE_PROMPTS}
+        forms[path] = {'checkpoints': checkpoints, 'pages': pages, 'resumed': len(pages), 'errors': []}
+
+    if args.deferred:
+        # Each round extracts every page up to its next unanswered request, then sends those requests as batches
+        backend = create_batch_backend(args.batch_backend, client, args.batch_dir)
+        rounds = []
+        run_deferred(
+            lambda deferred_client: rounds.append(extract_forms(deferred_client, forms, args, image_policy, tracer)),
+            backend, args.batch_dir, args.batch_poll_interval
+        )
+        extracted_pages = sum(rounds)
+    else:
+        extracted_pages = extract_forms(client, forms, args, image_policy, tracer)
+    extract_elapsed = time.perf_counter() - start
+
+    frame = build_frame(forms)
+
+    assess_start = time.perf_counter()
+    extracted = frame['Status'] != 'failed'
+    if args.contributions is not None:
+        provider = FixedContributions(args.contributions)
+    else:
+        provider = SQLiteContributions(args.contributions_db)
+    frame = pd.concat([assess_forms(frame[extracted].copy(), provider, datetime.today()), frame[~extracted]])
+    assess_elapsed = time.perf_counter() - assess_start
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    if args.output.endswith('.parquet'):
+        # Answers of the wrong type leave mixed columns, which Parquet cannot hold
+        frame.astype({column: 'string' for column in frame.columns if frame[column].dtype == object}).to_parquet(
+            args.output, index=False)
+    else:
+        frame.to_csv(args.output, index=False)
+    elapsed = time.perf_counter() - start
+
+    # Throughput only counts pages that were extracted in this run
+    statuses = frame['Status'].value_counts()
+    resumed_pages = sum(form['resumed'] for form in forms.values())
+    print(f"Forms: {statuses.get('complete', 0)} complete, {statuses.get('needs review', 0)} need review, "
+          f"{statuses.get('failed', 0)} failed")
+    print(f'Pages: {extracted_pages} extracted, {resumed_pages} resumed from checkpoints')
+    print(f'Extraction: {extract_elapsed:.1f}s, {extracted_pages / extract_elapsed * 60 if extract_elapsed else 0:.1f} '
+          f'pages/minute')
+    print(f'Assessment: {assess_elapsed * 1000:.1f}ms for {int(extracted.sum())} forms')
+    print(f'Elapsed: {elapsed:.1f}s, throughput: {len(forms) / elapsed * 60 if elapsed else 0:.1f} forms/minute')
+    for stage in tracer.summary():
+        print(f"  {stage['stage']:<12}{stage['count']:>6} runs{stage['mean_wall_seconds']:>10.2f}s mean"
+              f"{stage['prompt_tokens'] + stage['completion_tokens']:>12} tokens")
+    print(f'Wrote {args.output}')
+
+    if args.trace is not None:
+        with open(args.trace, 'w') as f:
+            f.write(tracer.to_json())
+        with open(os.path.splitext(args.trace)[0] + '.prom', 'w') as f:
+            f.write(tracer.to_prometheus())
+    return 1 if statuses.get('failed', 0) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
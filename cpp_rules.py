@@ -0,0 +1,231 @@
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from llm_cache import cached_completion
+
+MINIMUM_AGE = 60
+STANDARD_AGE = 65
+MAXIMUM_AGE = 70
+
+# Monthly adjustment before and after the 65th birthday, in percent, and its caps
+EARLY_REDUCTION = 0.6
+LATE_INCREASE = 0.7
+MAXIMUM_REDUCTION = 36
+MAXIMUM_INCREASE = 42
+
+# Contributions are spread over 20 years of payments starting at 65
+BASELINE_MONTHS = 240
+
+# Every possible start, in months after the applicant's birth month
+START_AGE_MONTHS = np.arange(MINIMUM_AGE * 12, MAXIMUM_AGE * 12 + 1)
+
+NARRATIVE_PROMPT = '''
+The applicant's name is {name}.
+The applicant was born on {date_of_birth} (YYYY-MM-DD).
+The applicant intends to start receiving CPP pension benefits on {start_date} (YYYY-MM).
+The applicant should start receiving benefits between the age of 60 and 70.
+The adjusted pension start date should be {pension_start_date}.
+The applicant has made a total of ${contributions:,.2f} in CPP contributions.
+The total contributions should be spread across 20 years if the applicant starts receiving benefits at age of 65.
+If the pension starts before age 65, it will be reduced by 0.6% for each month (or 7.2% per year) before the 65th
+birthday. The maximum reduction is 36% if the applicant starts their pension at age 60. This reduction is permanent.
+If the pension starts after age 65, it will increase by 0.7% for each month (or 8.4% per year) after the 65th
+birthday. The maximum increase is 42% if starting the pension at age 70. The increase is permanent, and there
+are no more increases after age 70.
+The percentage delta between the projected monthly payment and the baseline monthly payment is {percentage_impact}%.
+As such, the adjusted monthly payment is ${payment:,.2f}.
+---
+Write a clear paragraph explaining the rationale behind the calculation. Retain key figures.
+Do not have more than 2 decimal places for any number.
+Below the rationale, write a Python code block that performs the above calculations.
+'''
+
+
+def add_years(date, years):
+    # Birthdays on February 29 fall on February 28 in other years
+    try:
+        return date.replace(year=date.year + years)
+    except ValueError:
+        return date.replace(year=date.year + years, day=28)
+
+
+def months_between(start, end):
+    return (end.year - start.year) * 12 + end.month - start.month
+
+
+def adjustment_percentage(delta_months):
+    # Reduce or increase the payment for each month before or after the 65th birthday, for scalars or arrays
+    delta_months = np.asarray(delta_months)
+    return np.where(delta_months < 0, np.maximum(EARLY_REDUCTION * delta_months, -MAXIMUM_REDUCTION),
+                    np.minimum(LATE_INCREASE * delta_months, MAXIMUM_INCREASE))
+
+
+def to_months(dates):
+    # Calendar months of YYYY-MM-DD or YYYY-MM strings, datetimes or datetime64 values
+    return np.asarray(dates, dtype='datetime64[D]').astype('datetime64[M]')
+
+
+def turning_age(birth_dates, years):
+    # Vectorized add_years: the date each applicant turns the age, with February 29 birthdays on February 28
+    birth_days = np.asarray(birth_dates, dtype='datetime64[D]')
+    months = birth_days.astype('datetime64[M]') + years * 12
+    month_days = ((months + 1).astype('datetime64[D]') - months.astype('datetime64[D]')).astype(np.int64)
+    day = (birth_days - birth_days.astype('datetime64[M]').astype('datetime64[D]')).astype(np.int64)
+    return months.astype('datetime64[D]') + np.minimum(day, month_days - 1)
+
+
+def age_eligibility(birth_dates, today=None):
+    # Vectorized assess_age_eligibility, without the rationale
+    return turning_age(birth_dates, MINIMUM_AGE) <= np.datetime64(today or datetime.today(), 'D')
+
+
+def payment_scenarios(birth_dates, start_dates, contributions, as_soon_as_qualified=False):
+    # Vectorized payment calculation; the arguments broadcast against each other like NumPy arrays.
+    # Like calculate_payment, applicants starting as soon as they qualify start at the later of the start date
+    # and their 60th birthday month, with no latest start
+    birth_months = to_months(birth_dates)
+    start_months = np.maximum(to_months(start_dates), birth_months + MINIMUM_AGE * 12)
+    start_months = np.where(as_soon_as_qualified, start_months,
+                            np.minimum(start_months, birth_months + MAXIMUM_AGE * 12))
+    delta_months = (start_months - (birth_months + STANDARD_AGE * 12)).astype(np.int64)
+    percentage_impact = adjustment_percentage(delta_months)
+    baseline_payment = np.asarray(contributions, dtype=float) / BASELINE_MONTHS
+    return {
+        'start_month': start_months,
+        'delta_months': delta_months,
+        'percentage_impact': percentage_impact,
+        'payment': baseline_payment * (1 + percentage_impact / 100)
+    }
+
+
+def start_age_payments(contributions):
+    # Monthly payment for each start age from 60 to 70, in months, as a (..., 121) array;
+    # the adjustment only depends on the age at start, so birth dates are not needed
+    factors = 1 + adjustment_percentage(START_AGE_MONTHS - STANDARD_AGE * 12) / 100
+    return np.asarray(contributions, dtype=float)[..., np.newaxis] / BASELINE_MONTHS * factors
+
+
+def start_age_scenarios(date_of_birth, contributions):
+    # What-if table of one applicant's payment for each start month from 60 to 70
+    birth_month = to_months(date_of_birth)
+    scenarios = payment_scenarios(birth_month, birth_month + START_AGE_MONTHS, contributions)
+    return pd.DataFrame({
+        'Start month': scenarios['start_month'].astype(str),
+        'Age at start': START_AGE_MONTHS / 12,
+        'Months from 65': scenarios['delta_months'],
+        'Adjustment (%)': scenarios['percentage_impact'],
+        'Monthly payment': scenarios['payment']
+    })
+
+
+def assess_age_eligibility(date_of_birth, today=None):
+    today = today or datetime.today()
+    try:
+        birth_date = datetime.strptime(date_of_birth, '%Y-%m-%d')
+    except (TypeError, ValueError):
+        return {'eligible': False, 'rationale': f'The date of birth "{date_of_birth}" is not a YYYY-MM-DD date.'}
+
+    date_turning_60 = add_years(birth_date, MINIMUM_AGE)
+    eligible = date_turning_60 <= today
+    verb = 'turned' if eligible else 'turns'
+    return {
+        'eligible': eligible,
+        'date_turning_60': date_turning_60,
+        'rationale': f'The applicant was born on {birth_date:%Y-%m-%d} and {verb} 60 on {date_turning_60:%Y-%m-%d}, '
+                     f'so as of {today:%Y-%m-%d} they are {"at least" if eligible else "under"} 60 years old.'
+    }
+
+
+def calculate_payment(date_of_birth, pension_start, start_date, contributions, today=None):
+    today = today or datetime.today()
+    birth_date = datetime.strptime(date_of_birth, '%Y-%m-%d')
+    date_turning_60 = add_years(birth_date, MINIMUM_AGE)
+    date_turning_65 = add_years(birth_date, STANDARD_AGE)
+    date_turning_70 = add_years(birth_date, MAXIMUM_AGE)
+
+    # Start as soon as possible, or at the requested month moved into the window between 60 and 70
+    if pension_start == 'As soon as I qualify':
+        pension_start_date = max(date_turning_60, today)
+    else:
+        pension_start_date = min(max(datetime.strptime(start_date, '%Y-%m'), date_turning_60), date_turning_70)
+
+    delta_months = months_between(date_turning_65, pension_start_date)
+    percentage_impact = float(adjustment_percentage(delta_months))
+    baseline_payment = contributions / BASELINE_MONTHS
+    payment = baseline_payment * (1 + percentage_impact / 100)
+
+    calculation = {
+        'date_turning_65': date_turning_65,
+        'pension_start_date': pension_start_date,
+        'delta_months': delta_months,
+        'percentage_impact': percentage_impact,
+        'baseline_payment': baseline_payment,
+        'payment': payment
+    }
+    calculation['rationale'] = write_rationale(calculation, pension_start, start_date, contributions)
+    return calculation
+
+
+def write_rationale(calculation, pension_start, start_date, contributions):
+    pension_start_date = f'{calculation["pension_start_date"]:%Y-%m-%d}'
+    if pension_start == 'As soon as I qualify':
+        start = f'The pension starts as soon as the applicant qualifies, on {pension_start_date}'
+    elif pension_start_date.startswith(start_date):
+        start = f'The pension starts as requested on {pension_start_date}'
+    else:
+        start = (f'The requested start of {start_date} is outside the ages of 60 to 70, '
+                 f'so the pension starts on {pension_start_date}')
+
+    delta_months = calculation['delta_months']
+    if delta_months < 0:
+        adjustment = (f'{-delta_months} months before the 65th birthday on {calculation["date_turning_65"]:%Y-%m-%d}. '
+                      f'At {EARLY_REDUCTION}% per month, capped at {MAXIMUM_REDUCTION}%, the payment is permanently '
+                      f'reduced by {-calculation["percentage_impact"]:.2f}%.')
+    elif delta_months > 0:
+        adjustment = (f'{delta_months} months after the 65th birthday on {calculation["date_turning_65"]:%Y-%m-%d}. '
+                      f'At {LATE_INCREASE}% per month, capped at {MAXIMUM_INCREASE}%, the payment is permanently '
+                      f'increased by {calculation["percentage_impact"]:.2f}%.')
+    else:
+        adjustment = 'in the month of the 65th birthday, so the payment is neither reduced nor increased.'
+
+    return (f'{start}, {adjustment} '
+            f'The baseline monthly payment spreads the ${contributions:,.2f} of past contributions over '
+            f'{BASELINE_MONTHS} months (20 years from age 65): ${calculation["baseline_payment"]:,.2f}. '
+            f'The adjusted monthly payment is therefore ${calculation["payment"]:,.2f}.')
+
+
+# Only recent narratives are kept in memory; older ones are still in the LLM cache if asked for again
+MAX_NARRATIVES = 256
+
+_narratives = OrderedDict()
+_narratives_lock = threading.Lock()
+_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix='narrative')
+
+
+def request_narrative(client, name, date_of_birth, start_date, contributions, calculation):
+    # Write the LLM narrative in the background; a recent calculation is not written again
+    user_prompt = NARRATIVE_PROMPT.format(
+        name=name,
+        date_of_birth=date_of_birth,
+        start_date=start_date,
+        pension_start_date=f'{calculation["pension_start_date"]:%Y-%m-%d}',
+        contributions=contributions,
+        percentage_impact=calculation['percentage_impact'],
+        payment=calculation['payment']
+    )
+    with _narratives_lock:
+        # A failed narrative is written again on the next request
+        future = _narratives.get(user_prompt)
+        if future is None or future.done() and future.exception() is not None:
+            future = _narratives[user_prompt] = _executor.submit(
+                cached_completion, client, model='gpt-4o', messages=[{'role': 'user', 'content': user_prompt}]
+            )
+        _narratives.move_to_end(user_prompt)
+        while len(_narratives) > MAX_NARRATIVES:
+            _narratives.popitem(last=False)
+        return future
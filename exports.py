@@ -0,0 +1,71 @@
+import csv
+import hashlib
+import json
+from io import BytesIO, StringIO
+
+import pandas as pd
+from openpyxl import Workbook
+
+
+def digest_extracts(extracts):
+    return hashlib.sha256(json.dumps(extracts, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+
+def create_excel_binary_from_json(json_data):
+    # Write-only workbooks stream rows to disk instead of keeping every cell object in memory
+    wb = Workbook(write_only=True)
+
+    # Add tables to Excel by page
+    for page in sorted(json_data.keys()):
+        ws = wb.create_sheet(f'Page {page}')
+        for table in json_data[page]:
+            ws.append([table['title']])
+            ws.append([])
+            for row in table['content']:
+                ws.append(row)
+            ws.append([])
+            ws.append([])
+
+    # Save workbook to binary stream
+    binary_stream = BytesIO()
+    wb.save(binary_stream)
+    return binary_stream.getvalue()
+
+
+def iter_table_cells(json_data):
+    # Flatten the tables of every page into one long record per cell
+    for page in sorted(json_data.keys()):
+        for table_index, table in enumerate(json_data[page], start=1):
+            for row_index, row in enumerate(table['content'], start=1):
+                for column_index, value in enumerate(row, start=1):
+                    yield page, table_index, table['title'], row_index, column_index, value
+
+
+def create_csv_binary_from_json(json_data):
+    # One line per table row, prefixed with the page, table number and title
+    bfr = StringIO()
+    writer = csv.writer(bfr)
+    writer.writerow(['page', 'table', 'title', 'cells'])
+    for page in sorted(json_data.keys()):
+        for table_index, table in enumerate(json_data[page], start=1):
+            for row in table['content']:
+                writer.writerow([page, table_index, table['title'], *row])
+    return bfr.getvalue().encode('utf-8')
+
+
+def create_parquet_binary_from_json(json_data):
+    # Parquet needs a fixed schema, so store one record per cell with its value as text
+    columns = ['page', 'table', 'title', 'row', 'column', 'value']
+    df = pd.DataFrame(iter_table_cells(json_data), columns=columns)
+    df['value'] = df['value'].map(lambda value: None if value is None else str(value))
+    binary_stream = BytesIO()
+    df.to_parquet(binary_stream, index=False)
+    return binary_stream.getvalue()
+
+
+EXPORT_FORMATS = {
+    'xlsx': {'label': 'Excel', 'builder': create_excel_binary_from_json, 'mime': 'application/vnd.ms-excel'},
+    'csv': {'label': 'CSV', 'builder': create_csv_binary_from_json, 'mime': 'text/csv'},
+    'parquet': {'label': 'Parquet', 'builder': create_parquet_binary_from_json,
+                'mime': 'application/vnd.apache.parquet'}
+}
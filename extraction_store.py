@@ -0,0 +1,113 @@
+import json
+import os
+import threading
+import time
+
+from sqlite_store import SQLiteStore, run_admin_command
+
+STORE_PATH = os.environ.get('EXTRACTION_STORE_PATH', os.path.join('.cache', 'extractions.sqlite3'))
+STORE_MAX_MB = float(os.environ.get('EXTRACTION_STORE_MAX_MB', 64))
+STORE_MAX_AGE_DAYS = float(os.environ.get('EXTRACTION_STORE_MAX_AGE_DAYS', 30))
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS documents (
+    key TEXT PRIMARY KEY,
+    version TEXT NOT NULL,
+    extracted TEXT NOT NULL,
+    corrections TEXT NOT NULL,
+    assessments TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS documents_updated_at ON documents (updated_at);
+'''
+
+COLUMNS = ['extracted', 'corrections', 'assessments']
+
+
+class ExtractionStore(SQLiteStore):
+    # Extracted values, caseworker corrections and assessments of each uploaded document, keyed by its content hash,
+    # in SQLite so that every server process sees the same documents
+    def __init__(self, path, max_bytes, max_age):
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        super().__init__(path, SCHEMA)
+
+    def get(self, key, version):
+        # Documents extracted with other fields or prompts, or older than the retention period, are not returned
+        row = self._connect().execute(
+            'SELECT extracted, corrections, assessments, created_at FROM documents '
+            'WHERE key = ? AND version = ? AND updated_at >= ?',
+            (key, version, time.time() - self.max_age)
+        ).fetchone()
+        if row is None:
+            return None
+        return {**{column: json.loads(value) for column, value in zip(COLUMNS, row)}, 'created_at': row[3]}
+
+    def save_extraction(self, key, version, extracted):
+        # A new extraction starts the document over, without the corrections and assessments of an earlier one
+        now = time.time()
+        self._write(
+            key,
+            'INSERT OR REPLACE INTO documents (key, version, extracted, corrections, assessments, size, created_at, '
+            "updated_at) VALUES (?, ?, ?, '{}', '{}', 0, ?, ?)",
+            (key, version, json.dumps(extracted), now, now)
+        )
+
+    def update(self, key, column, value):
+        # Replace the corrections or the assessments of a stored document
+        self._write(
+            key,
+            f'UPDATE documents SET {column} = ?, updated_at = ? WHERE key = ?',
+            (json.dumps(value, default=str), time.time(), key)
+        )
+
+    def _write(self, key, sql, params):
+        with self.transaction() as conn:
+            conn.execute(sql, params)
+            conn.execute(
+                'UPDATE documents SET size = length(extracted) + length(corrections) + length(assessments) '
+                'WHERE key = ?',
+                (key,)
+            )
+            self._evict(conn)
+
+    def _evict(self, conn):
+        # Drop documents past the retention period, then the least recently updated ones until under the size limit
+        conn.execute('DELETE FROM documents WHERE updated_at < ?', (time.time() - self.max_age,))
+        total_bytes = conn.execute('SELECT COALESCE(SUM(size), 0) FROM documents').fetchone()[0]
+        for key, size in conn.execute('SELECT key, size FROM documents ORDER BY updated_at').fetchall():
+            if total_bytes <= self.max_bytes:
+                break
+            conn.execute('DELETE FROM documents WHERE key = ?', (key,))
+            total_bytes -= size
+
+    def stats(self):
+        documents, total_bytes = self._connect().execute(
+            'SELECT COUNT(*), COALESCE(SUM(size), 0) FROM documents'
+        ).fetchone()
+        return {'documents': documents, 'bytes': total_bytes}
+
+    def clear(self):
+        self._connect().execute('DELETE FROM documents')
+
+
+_default_store = None
+_default_store_lock = threading.Lock()
+
+
+def get_default_store():
+    global _default_store
+    with _default_store_lock:
+        if _default_store is None:
+            _default_store = ExtractionStore(
+                STORE_PATH,
+                max_bytes=STORE_MAX_MB * 1024 * 1024,
+                max_age=STORE_MAX_AGE_DAYS * 24 * 60 * 60
+            )
+        return _default_store
+
+
+if __name__ == '__main__':
+    run_admin_command('Inspect or clear the stored CPP form extractions', get_default_store)
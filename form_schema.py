@@ -0,0 +1,65 @@
+import re
+
+JSON_TYPES = {'int': 'integer', 'float': 'number', 'str': 'string'}
+
+# Patterns of the date formats used in field registries
+FORMAT_PATTERNS = {'YYYY-MM-DD': r'^\d{4}-\d{2}-\d{2}$', 'YYYY-MM': r'^\d{4}-\d{2}$'}
+
+
+def field_schema(field):
+    # Every field may be null, since applicants leave fields blank
+    schema = {'type': [JSON_TYPES[field['type']], 'null']}
+    if 'options' in field:
+        schema['enum'] = field['options'] + [None]
+    if 'format' in field:
+        schema['pattern'] = FORMAT_PATTERNS[field['format']]
+    return schema
+
+
+def build_schema(fields):
+    return {
+        'type': 'object',
+        'properties': {field['ID']: field_schema(field) for field in fields},
+        'required': [field['ID'] for field in fields],
+        'additionalProperties': False
+    }
+
+
+def coerce_value(value, schema):
+    # Undo harmless formatting differences, e.g. spaces in a number or the case of an option
+    if not isinstance(value, str):
+        return value
+    value = value.strip()
+    if value == '':
+        return None
+    if schema['type'][0] == 'integer' and re.fullmatch(r'[\d\s().-]*\d[\d\s().-]*', value):
+        return int(re.sub(r'\D', '', value))
+    if 'enum' in schema:
+        return next((option for option in schema['enum'] if option and option.lower() == value.lower()), value)
+    return value
+
+
+def is_valid(value, schema):
+    if value is None:
+        return True
+    expected_type = schema['type'][0]
+    if expected_type == 'integer' and (not isinstance(value, int) or isinstance(value, bool)):
+        return False
+    if expected_type == 'number' and (not isinstance(value, (int, float)) or isinstance(value, bool)):
+        return False
+    if expected_type == 'string' and not isinstance(value, str):
+        return False
+    if 'enum' in schema and value not in schema['enum']:
+        return False
+    return 'pattern' not in schema or re.match(schema['pattern'], value) is not None
+
+
+def validate_values(values, schema):
+    # Coerce the answers to the schema, and list the fields that are missing or still do not match it
+    coerced = {}
+    invalid = []
+    for key, property_schema in schema['properties'].items():
+        coerced[key] = coerce_value(values.get(key), property_schema)
+        if key not in values or not is_valid(coerced[key], property_schema):
+            invalid.append(key)
+    return coerced, invalid
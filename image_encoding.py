@@ -0,0 +1,114 @@
+import argparse
+import base64
+import math
+import tempfile
+import time
+from io import BytesIO
+
+from PIL import Image
+
+from pdf_pages import count_pages, iter_page_images
+
+# Rendering DPI and payload settings of page images sent to the vision models
+ENCODING_POLICIES = {
+    'lossless': {'dpi': 200, 'max_dimension': None, 'grayscale': False, 'format': 'png', 'quality': None,
+                 'detail': 'auto'},
+    'high': {'dpi': 200, 'max_dimension': 2048, 'grayscale': True, 'format': 'jpeg', 'quality': 90,
+             'detail': 'high'},
+    'balanced': {'dpi': 150, 'max_dimension': 1600, 'grayscale': True, 'format': 'webp', 'quality': 80,
+                 'detail': 'high'},
+    'low': {'dpi': 100, 'max_dimension': 1024, 'grayscale': True, 'format': 'jpeg', 'quality': 70,
+            'detail': 'low'}
+}
+
+MIME_TYPES = {'png': 'image/png', 'jpeg': 'image/jpeg', 'webp': 'image/webp'}
+
+# Effective resolution of page crops, a little above what the model sees of a whole page after its own downscaling
+CROP_DPI = 120
+
+
+def prepare_image(image, policy):
+    if policy['grayscale']:
+        image = image.convert('L')
+    elif image.mode not in ('RGB', 'L'):
+        image = image.convert('RGB')
+
+    max_dimension = policy['max_dimension']
+    if max_dimension is not None and max(image.size) > max_dimension:
+        image = image.copy()
+        image.thumbnail((max_dimension, max_dimension), Image.LANCZOS)
+    return image
+
+
+def encode_image(image, policy):
+    # Encode a page once into the image_url part of a chat message, so every stage can reuse it
+    image = prepare_image(image, policy)
+    bfr = BytesIO()
+    save_options = {'quality': policy['quality']} if policy['quality'] is not None else {}
+    image.save(bfr, format=policy['format'], **save_options)
+    encoded = base64.b64encode(bfr.getvalue()).decode('utf-8')
+    return {'url': f"data:{MIME_TYPES[policy['format']]};base64,{encoded}", 'detail': policy['detail']}
+
+
+def encode_crop(image, box, policy):
+    # Encode a region of a page at CROP_DPI; crops that fit in a single 512px tile are sent at low detail
+    crop = image.crop(box)
+    scale = min(1.0, CROP_DPI / policy['dpi'])
+    if scale < 1.0:
+        crop = crop.resize((max(1, round(crop.width * scale)), max(1, round(crop.height * scale))), Image.LANCZOS)
+    detail = 'low' if max(crop.size) <= 512 else policy['detail']
+    return encode_image(crop, dict(policy, detail=detail))
+
+
+def estimate_image_tokens(width, height, detail):
+    # Follows OpenAI's published tiling rules for gpt-4o vision input
+    if detail == 'low':
+        return 85
+    scale = min(1.0, 2048 / max(width, height))
+    width, height = width * scale, height * scale
+    scale = min(1.0, 768 / min(width, height))
+    width, height = width * scale, height * scale
+    return 85 + 170 * math.ceil(width / 512) * math.ceil(height / 512)
+
+
+def benchmark_policies(pdf_bytes, pages, policies):
+    # Measure the payload size and encoding time of every policy over the same pages
+    report = []
+    with tempfile.TemporaryDirectory(prefix='encoding-') as page_dir:
+        for name, policy in policies.items():
+            payload_bytes = 0
+            encode_seconds = 0.0
+            image_tokens = 0
+            for _, page_path in iter_page_images(pdf_bytes, pages, page_dir, dpi=policy['dpi']):
+                with Image.open(page_path) as image:
+                    image.load()
+                    start = time.perf_counter()
+                    image_url = encode_image(image, policy)
+                    encode_seconds += time.perf_counter() - start
+                    width, height = prepare_image(image, policy).size
+                payload_bytes += len(image_url['url'])
+                image_tokens += estimate_image_tokens(width, height, policy['detail'])
+            report.append({
+                'policy': name,
+                'pages': len(pages),
+                'payload_kb_per_page': payload_bytes / len(pages) / 1024,
+                'encode_ms_per_page': encode_seconds / len(pages) * 1000,
+                'image_tokens_per_page': image_tokens / len(pages)
+            })
+    return report
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compare payload size and encoding time of image policies')
+    parser.add_argument('pdf', help='PDF file to sample pages from')
+    parser.add_argument('--pages', type=int, default=3, help='number of leading pages to sample')
+    args = parser.parse_args()
+
+    with open(args.pdf, 'rb') as f:
+        pdf = f.read()
+    sample_pages = range(min(args.pages, count_pages(pdf)))
+
+    print(f"{'policy':<10}{'KB/page':>12}{'encode ms/page':>16}{'image tokens/page':>20}")
+    for row in benchmark_policies(pdf, sample_pages, ENCODING_POLICIES):
+        print(f"{row['policy']:<10}{row['payload_kb_per_page']:>12.1f}{row['encode_ms_per_page']:>16.1f}"
+              f"{row['image_tokens_per_page']:>20.0f}")
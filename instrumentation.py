@@ -0,0 +1,77 @@
+import json
+import threading
+import time
+from contextlib import contextmanager
+
+COUNTERS = ['queue_wait_seconds', 'payload_bytes', 'prompt_tokens', 'completion_tokens', 'llm_calls', 'retries',
+            'cache_hits']
+
+_current = threading.local()
+
+
+def record(**increments):
+    # Add to the counters of the span running on this thread, if any
+    span = getattr(_current, 'span', None)
+    if span is not None:
+        for name, value in increments.items():
+            span[name] += value
+
+
+class Tracer:
+    # Collects one span per page and stage, safe to use from worker threads
+    def __init__(self):
+        self.spans = []
+        self._lock = threading.Lock()
+        self._origin = time.perf_counter()
+
+    @contextmanager
+    def span(self, page, stage, queued_at=None):
+        span = {'page': page, 'stage': stage, 'thread': threading.current_thread().name, **dict.fromkeys(COUNTERS, 0)}
+        start = time.perf_counter()
+        if queued_at is not None:
+            span['queue_wait_seconds'] = start - queued_at
+        previous = getattr(_current, 'span', None)
+        _current.span = span
+        try:
+            yield span
+        finally:
+            _current.span = previous
+            span['start_seconds'] = start - self._origin
+            span['wall_seconds'] = time.perf_counter() - start
+            with self._lock:
+                self.spans.append(span)
+
+    def summary(self):
+        # Aggregate the spans by stage, slowest total wall time first
+        stages = {}
+        with self._lock:
+            spans = list(self.spans)
+        for span in spans:
+            stage = stages.setdefault(span['stage'], {'stage': span['stage'], 'count': 0, 'wall_seconds': 0.0,
+                                                      'max_wall_seconds': 0.0, **dict.fromkeys(COUNTERS, 0)})
+            stage['count'] += 1
+            stage['wall_seconds'] += span['wall_seconds']
+            stage['max_wall_seconds'] = max(stage['max_wall_seconds'], span['wall_seconds'])
+            for name in COUNTERS:
+                stage[name] += span[name]
+        for stage in stages.values():
+            stage['mean_wall_seconds'] = stage['wall_seconds'] / stage['count']
+        return sorted(stages.values(), key=lambda stage: stage['wall_seconds'], reverse=True)
+
+    def to_json(self):
+        with self._lock:
+            spans = sorted(self.spans, key=lambda span: span['start_seconds'])
+        return json.dumps({'spans': spans, 'summary': self.summary()}, indent=2)
+
+    def to_prometheus(self, prefix='pipeline'):
+        lines = []
+        metrics = [('wall_seconds', 'seconds_total', 'Wall time spent in the stage'),
+                   ('count', 'spans_total', 'Number of times the stage ran')]
+        metrics += [(name, f'{name}_total', f'Total {name.replace("_", " ")} of the stage') for name in COUNTERS]
+        summary = self.summary()
+        for key, metric, description in metrics:
+            lines.append(f'# HELP {prefix}_stage_{metric} {description}')
+            lines.append(f'# TYPE {prefix}_stage_{metric} counter')
+            for stage in summary:
+                lines.append(f'{prefix}_stage_{metric}{{stage="{stage["stage"]}"}} {stage[key]}')
+        return '\n'.join(lines) + '\n'
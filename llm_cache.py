@@ -0,0 +1,147 @@
+import hashlib
+import json
+import os
+import threading
+import time
+
+from instrumentation import record
+from sqlite_store import SQLiteStore, run_admin_command
+
+CACHE_DIR = os.environ.get('LLM_CACHE_DIR', '.cache')
+CACHE_MAX_MB = float(os.environ.get('LLM_CACHE_MAX_MB', 512))
+CACHE_MAX_AGE_DAYS = float(os.environ.get('LLM_CACHE_MAX_AGE_DAYS', 30))
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS entries (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    created_at REAL NOT NULL,
+    accessed_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS entries_accessed_at ON entries (accessed_at);
+CREATE TABLE IF NOT EXISTS counters (
+    name TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+'''
+
+
+class LLMCache(SQLiteStore):
+    # Content-addressed store of LLM responses in SQLite, which is safe to share across processes
+    def __init__(self, path, max_bytes, max_age):
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        super().__init__(path, SCHEMA)
+
+    @staticmethod
+    def make_key(payload):
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def _count(self, conn, name):
+        conn.execute(
+            'INSERT INTO counters (name, value) VALUES (?, 1) ON CONFLICT (name) DO UPDATE SET value = value + 1',
+            (name,)
+        )
+
+    def get(self, key):
+        conn = self._connect()
+        now = time.time()
+        row = conn.execute(
+            'SELECT value FROM entries WHERE key = ? AND created_at >= ?', (key, now - self.max_age)
+        ).fetchone()
+        if row is None:
+            self._count(conn, 'misses')
+            return None
+        conn.execute('UPDATE entries SET accessed_at = ? WHERE key = ?', (now, key))
+        self._count(conn, 'hits')
+        return row[0]
+
+    def set(self, key, value):
+        now = time.time()
+        with self.transaction() as conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO entries (key, value, size, created_at, accessed_at) VALUES (?, ?, ?, ?, ?)',
+                (key, value, len(value.encode('utf-8')), now, now)
+            )
+            self._evict(conn, now)
+
+    def _evict(self, conn, now):
+        # Drop expired entries first, then the least recently used ones until under the size limit
+        conn.execute('DELETE FROM entries WHERE created_at < ?', (now - self.max_age,))
+        total_bytes = conn.execute('SELECT COALESCE(SUM(size), 0) FROM entries').fetchone()[0]
+        if total_bytes <= self.max_bytes:
+            return
+        evicted = 0
+        for key, size in conn.execute('SELECT key, size FROM entries ORDER BY accessed_at').fetchall():
+            if total_bytes <= self.max_bytes:
+                break
+            conn.execute('DELETE FROM entries WHERE key = ?', (key,))
+            total_bytes -= size
+            evicted += 1
+        conn.execute(
+            'INSERT INTO counters (name, value) VALUES (?, ?) ON CONFLICT (name) DO UPDATE SET value = value + ?',
+            ('evictions', evicted, evicted)
+        )
+
+    def stats(self):
+        conn = self._connect()
+        counters = dict(conn.execute('SELECT name, value FROM counters').fetchall())
+        entries, total_bytes = conn.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries').fetchone()
+        return {
+            'hits': counters.get('hits', 0),
+            'misses': counters.get('misses', 0),
+            'evictions': counters.get('evictions', 0),
+            'entries': entries,
+            'bytes': total_bytes
+        }
+
+    def clear(self):
+        conn = self._connect()
+        conn.execute('DELETE FROM entries')
+        conn.execute('DELETE FROM counters')
+
+
+_default_cache = None
+_default_cache_lock = threading.Lock()
+
+
+def get_default_cache():
+    global _default_cache
+    with _default_cache_lock:
+        if _default_cache is None:
+            _default_cache = LLMCache(
+                os.path.join(CACHE_DIR, 'llm_cache.sqlite3'),
+                max_bytes=CACHE_MAX_MB * 1024 * 1024,
+                max_age=CACHE_MAX_AGE_DAYS * 24 * 60 * 60
+            )
+        return _default_cache
+
+
+def request_payload(request):
+    return json.dumps(request, sort_keys=True, separators=(',', ':'))
+
+
+def cached_completion(client, **request):
+    # Return the message content of a chat completion, calling OpenAI only on a cache miss
+    # The request holds the model name, the prompts and the base64 page image
+    payload = request_payload(request)
+    cache = get_default_cache()
+    key = cache.make_key(payload)
+    content = cache.get(key)
+    if content is not None:
+        record(cache_hits=1)
+        return content
+
+    completion = client.chat.completions.create(**request)
+    content = completion.choices[0].message.content
+    record(payload_bytes=len(payload), llm_calls=1)
+    if completion.usage is not None:
+        record(prompt_tokens=completion.usage.prompt_tokens, completion_tokens=completion.usage.completion_tokens)
+    if completion.choices[0].finish_reason == 'stop':
+        cache.set(key, content)
+    return content
+
+
+if __name__ == '__main__':
+    run_admin_command('Inspect or clear the on-disk LLM response cache', get_default_cache)
@@ -0,0 +1,98 @@
+import re
+
+from table_detection import TABLE_ROW_PATTERN
+
+END_OF_TABLE = '#####END-OF-TABLE#####'
+
+CELL_DELIMITER_PATTERN = re.compile(r'(?<!\\)\|')
+SEPARATOR_CELL_PATTERN = re.compile(r'^:?-+:?$')
+CODE_FENCE_PATTERN = re.compile(r'^\s*(```|~~~)')
+FORMATTING_PATTERN = re.compile(r'(\*\*|__)(.+?)\1|(?<![\w*])\*(?!\s)(.+?)(?<!\s)\*(?![\w*])')
+HEADING_PATTERN = re.compile(r'^\s*(#+\s+.+|\*\*[^*]+\*\*:?)\s*$')
+LINE_BREAK_PATTERN = re.compile(r'<br\s*/?>', re.IGNORECASE)
+NUMBER_PATTERN = re.compile(
+    r'^(?P<open>\()?\s*(?P<sign>[-−])?\s*\$?\s*(?P<integer>\d{1,3}(?:,\d{3})+|\d+)(?P<fraction>\.\d+)?\s*(?(open)\))$'
+)
+
+
+def split_table_chunks(markdown_content):
+    # The formatting stage terminates every table with END_OF_TABLE, so each chunk holds one table
+    chunks = markdown_content.split(END_OF_TABLE)
+    return [(chunk, i < len(chunks) - 1) for i, chunk in enumerate(chunks)]
+
+
+def clean_text(text):
+    text = LINE_BREAK_PATTERN.sub(' ', text)
+    text = FORMATTING_PATTERN.sub(lambda match: match.group(2) or match.group(3), text)
+    return text.replace('\\|', '|').strip()
+
+
+def clean_title(line):
+    return clean_text(line.lstrip('#').strip()).rstrip(':').strip()
+
+
+def pick_title(lines):
+    # Prefer the last Markdown heading or fully bold line above the table, otherwise its first line of text
+    headings = [line for line in lines if HEADING_PATTERN.match(line)]
+    if headings:
+        return clean_title(headings[-1])
+    return clean_title(lines[0]) if lines else ''
+
+
+def split_row(line):
+    return [clean_text(cell) for cell in CELL_DELIMITER_PATTERN.split(line.strip())[1:-1]]
+
+
+def is_separator_row(cells):
+    return len(cells) > 0 and all(SEPARATOR_CELL_PATTERN.match(cell.replace(' ', '')) for cell in cells)
+
+
+def coerce_number(cell):
+    match = NUMBER_PATTERN.match(cell)
+    if match is None:
+        return cell
+    integer = match.group('integer').replace(',', '')
+    if match.group('fraction') is None and len(integer) > 1 and integer.startswith('0'):
+        return cell  # keep codes such as account numbers intact
+    negative = match.group('open') is not None or match.group('sign') is not None
+    if match.group('fraction') is None:
+        value = int(integer)
+    else:
+        value = float(integer + match.group('fraction'))
+    return -value if negative else value
+
+
+def normalise_rows(rows):
+    # Pad every row to the widest one, then drop trailing columns that are empty throughout
+    width = max(len(row) for row in rows)
+    rows = [row + [''] * (width - len(row)) for row in rows]
+    while width > 1 and all(row[width - 1] == '' for row in rows):
+        width -= 1
+    return [[coerce_number(cell) for cell in row[:width]] for row in rows]
+
+
+def parse_table_chunk(chunk, terminated):
+    # Return the tables found in the chunk, or None when it cannot be parsed reliably
+    tables = []
+    title_lines = []
+    rows = []
+    for line in chunk.splitlines() + ['']:
+        if TABLE_ROW_PATTERN.match(line):
+            cells = split_row(line)
+            if not is_separator_row(cells):
+                rows.append(cells)
+        elif line.strip().startswith('|'):
+            return None  # a broken table row
+        else:
+            if rows:
+                tables.append({'title': pick_title(title_lines), 'content': normalise_rows(rows)})
+                title_lines = []
+                rows = []
+            # Replies wrapped in a code fence would otherwise get the fence as their title
+            if line.strip() and not CODE_FENCE_PATTERN.match(line):
+                title_lines.append(line)
+
+    if terminated and not tables:
+        return None  # the formatting stage reported a table that is not a Markdown table
+    return tables
+
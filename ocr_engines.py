@@ -0,0 +1,100 @@
+import multiprocessing
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from io import BytesIO
+
+import pytesseract
+from llama_parse import LlamaParse
+from PIL import Image
+
+
+def chain_future(source, fn):
+    # Return a future that resolves to fn(result) once the source future is done
+    target = Future()
+
+    def resolve(future):
+        try:
+            target.set_result(fn(future.result()))
+        except Exception as e:
+            target.set_exception(e)
+
+    source.add_done_callback(resolve)
+    return target
+
+
+class OCREngine:
+    # Engines are started once per document, then asked for the text of each page as it is rendered;
+    # open_page returns the page image as a binary file
+    def start(self, pdf_bytes, file_name):
+        pass
+
+    def submit(self, page, open_page):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class LlamaParseEngine(OCREngine):
+    # Parses the whole document remotely in the background, while pages are being rasterized
+    def __init__(self, api_key, parser_factory=LlamaParse):
+        self.api_key = api_key
+        self.parser_factory = parser_factory
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self._documents = None
+
+    def _parse(self, pdf_bytes, file_name):
+        parser = self.parser_factory(
+            api_key=self.api_key,
+            result_type='markdown',
+            verbose=True
+        )
+        return parser.load_data(BytesIO(pdf_bytes), extra_info={'file_name': file_name})
+
+    def start(self, pdf_bytes, file_name):
+        self._documents = self._executor.submit(self._parse, pdf_bytes, file_name)
+
+    def submit(self, page, open_page):
+        return chain_future(self._documents, lambda documents: documents[page].text if page < len(documents) else '')
+
+    def close(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+def ocr_page_with_tesseract(image_bytes, language):
+    with Image.open(BytesIO(image_bytes)) as image:
+        return pytesseract.image_to_string(image, lang=language)
+
+
+class TesseractEngine(OCREngine):
+    # Runs Tesseract locally on each rendered page across a process pool, with no API key needed
+    def __init__(self, max_workers=None, language='eng'):
+        self.language = language
+        # Forking the threaded Streamlit server can deadlock the children, so start them from a clean process
+        self._executor = ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context(
+            'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+        ))
+
+    def submit(self, page, open_page):
+        with open_page() as f:
+            return self._executor.submit(ocr_page_with_tesseract, f.read(), self.language)
+
+    def close(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+OCR_ENGINES = {
+    'llamaparse': lambda llama_cloud_api_key, max_workers: LlamaParseEngine(llama_cloud_api_key),
+    'tesseract': lambda llama_cloud_api_key, max_workers: TesseractEngine(max_workers=max_workers)
+}
+
+
+def create_ocr_engine(name, llama_cloud_api_key=None, max_workers=None):
+    if name not in OCR_ENGINES:
+        raise ValueError(f'Unknown OCR engine: {name}')
+    return OCR_ENGINES[name](llama_cloud_api_key, max_workers)
@@ -0,0 +1,195 @@
+import os
+import random
+import threading
+import time
+from collections import OrderedDict, deque
+from types import SimpleNamespace
+
+import httpx
+import openai
+from openai import OpenAI
+
+from instrumentation import record
+
+REQUESTS_PER_MINUTE = float(os.environ.get('OPENAI_REQUESTS_PER_MINUTE', 500))
+TOKENS_PER_MINUTE = float(os.environ.get('OPENAI_TOKENS_PER_MINUTE', 200000))
+CONNECTION_POOL_SIZE = int(os.environ.get('OPENAI_CONNECTION_POOL_SIZE', 32))
+
+# Rough token cost of one image part, used until the response reports actual usage
+IMAGE_TOKENS = {'low': 85, 'high': 1105, 'auto': 1105}
+
+RETRYABLE_ERRORS = (openai.RateLimitError, openai.APIConnectionError, openai.InternalServerError)
+
+
+class TokenBucket:
+    # Refills continuously at the current rate, which backs off on 429s and recovers on successes
+    def __init__(self, per_minute):
+        self.max_rate = per_minute / 60
+        self.rate = self.max_rate
+        self.capacity = per_minute
+        self.level = per_minute
+        self.updated = time.monotonic()
+
+    def refill(self, now):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount):
+        amount = min(amount, self.capacity)
+        return 0.0 if self.level >= amount else (amount - self.level) / self.rate
+
+    def consume(self, amount):
+        self.level -= min(amount, self.capacity)
+
+    def slow_down(self):
+        self.rate = max(self.max_rate * 0.1, self.rate * 0.7)
+        self.level = min(self.level, 0)
+
+    def speed_up(self):
+        self.rate = min(self.max_rate, self.rate + self.max_rate * 0.05)
+
+
+class RateLimiter:
+    # Shares request and token budgets across sessions, serving waiting sessions round-robin
+    def __init__(self, requests_per_minute, tokens_per_minute):
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+        self._condition = threading.Condition()
+        self._waiting = OrderedDict()
+
+    def _is_next(self, session, ticket):
+        return next(iter(self._waiting)) == session and self._waiting[session][0] is ticket
+
+    def acquire(self, session, tokens):
+        ticket = object()
+        start = time.monotonic()
+        with self._condition:
+            self._waiting.setdefault(session, deque()).append(ticket)
+            try:
+                while True:
+                    now = time.monotonic()
+                    self.requests.refill(now)
+                    self.tokens.refill(now)
+                    if not self._is_next(session, ticket):
+                        self._condition.wait()
+                        continue
+                    wait_time = max(self.requests.wait_time(1), self.tokens.wait_time(tokens))
+                    if wait_time > 0:
+                        self._condition.wait(wait_time)
+                        continue
+                    self.requests.consume(1)
+                    self.tokens.consume(tokens)
+                    break
+            finally:
+                # Move this session behind the other waiting sessions; a thread interrupted while waiting also
+                # leaves, so its ticket cannot hold up everyone behind it
+                self._waiting[session].remove(ticket)
+                if self._waiting[session]:
+                    self._waiting.move_to_end(session)
+                else:
+                    del self._waiting[session]
+                self._condition.notify_all()
+        record(queue_wait_seconds=time.monotonic() - start)
+
+    def settle(self, estimated_tokens, actual_tokens):
+        # Return over-estimated tokens to the bucket, or take the shortfall, owing at most a minute's budget
+        with self._condition:
+            level = self.tokens.level + estimated_tokens - actual_tokens
+            self.tokens.level = max(-self.tokens.capacity, min(self.tokens.capacity, level))
+            self.requests.speed_up()
+            self.tokens.speed_up()
+            self._condition.notify_all()
+
+    def slow_down(self):
+        with self._condition:
+            self.requests.slow_down()
+            self.tokens.slow_down()
+
+
+def estimate_tokens(request):
+    text_chars = 0
+    image_tokens = 0
+    for message in request['messages']:
+        if isinstance(message['content'], str):
+            text_chars += len(message['content'])
+            continue
+        for part in message['content']:
+            if part['type'] == 'text':
+                text_chars += len(part['text'])
+            else:
+                image_tokens += IMAGE_TOKENS[part['image_url'].get('detail', 'auto')]
+    return text_chars // 4 + image_tokens + request.get('max_tokens', 1000)
+
+
+def backoff_delay(attempt, error, base_delay=1.0, max_delay=60.0):
+    # Full-jitter exponential backoff, but never sooner than the server's Retry-After
+    delay = random.uniform(0, min(max_delay, base_delay * 2 ** attempt))
+    response = getattr(error, 'response', None)
+    if response is not None and 'retry-after' in response.headers:
+        try:
+            delay = max(delay, float(response.headers['retry-after']))
+        except ValueError:
+            pass
+    return delay
+
+
+class RateLimitedClient:
+    # Looks like an OpenAI client to the stage functions, but goes through the shared limiter and retries with backoff
+    def __init__(self, client, limiter, session, max_retries=6):
+        self.client = client
+        self.limiter = limiter
+        self.session = session
+        self.max_retries = max_retries
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create_chat_completion))
+
+    def create_chat_completion(self, **request):
+        estimated_tokens = estimate_tokens(request)
+        for attempt in range(self.max_retries + 1):
+            self.limiter.acquire(self.session, estimated_tokens)
+            try:
+                completion = self.client.chat.completions.create(**request)
+            except RETRYABLE_ERRORS as e:
+                if isinstance(e, openai.RateLimitError):
+                    self.limiter.slow_down()
+                if attempt == self.max_retries:
+                    raise
+                record(retries=1)
+                time.sleep(backoff_delay(attempt, e))
+                continue
+
+            actual_tokens = completion.usage.total_tokens if completion.usage is not None else estimated_tokens
+            self.limiter.settle(estimated_tokens, actual_tokens)
+            return completion
+
+
+_shared_clients = {}
+_rate_limiter = None
+_lock = threading.Lock()
+
+
+def get_shared_client(api_key):
+    # One client per process, so every session reuses the same pool of keep-alive connections
+    with _lock:
+        if api_key not in _shared_clients:
+            http_client = httpx.Client(
+                limits=httpx.Limits(
+                    max_connections=CONNECTION_POOL_SIZE,
+                    max_keepalive_connections=CONNECTION_POOL_SIZE,
+                    keepalive_expiry=60
+                ),
+                timeout=httpx.Timeout(120, connect=10)
+            )
+            _shared_clients[api_key] = OpenAI(api_key=api_key, http_client=http_client, max_retries=0)
+        return _shared_clients[api_key]
+
+
+def get_rate_limiter():
+    global _rate_limiter
+    with _lock:
+        if _rate_limiter is None:
+            _rate_limiter = RateLimiter(REQUESTS_PER_MINUTE, TOKENS_PER_MINUTE)
+        return _rate_limiter
+
+
+def get_session_client(api_key, session):
+    return RateLimitedClient(get_shared_client(api_key), get_rate_limiter(), session)
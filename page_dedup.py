@@ -0,0 +1,84 @@
+import re
+import threading
+from concurrent.futures import Future
+
+from PIL import Image
+
+WORD_PATTERN = re.compile(r'\w+')
+
+
+def dhash(image, size=8):
+    # Difference hash: one bit per horizontally adjacent pixel pair of a small grayscale thumbnail
+    pixels = list(image.convert('L').resize((size + 1, size), Image.Resampling.LANCZOS).getdata())
+    bits = 0
+    for row in range(size):
+        for col in range(size):
+            bits = bits << 1 | (pixels[row * (size + 1) + col] > pixels[row * (size + 1) + col + 1])
+    return bits
+
+
+def hamming_distance(a, b):
+    return bin(a ^ b).count('1')
+
+
+def text_shingles(text, k=5):
+    # Overlapping k-word sequences of the normalised text
+    words = WORD_PATTERN.findall(text.lower())
+    k = min(k, len(words))
+    return {' '.join(words[i:i + k]) for i in range(len(words) - k + 1)} if words else set()
+
+
+def jaccard_similarity(a, b):
+    if not a and not b:
+        return 1.0
+    return len(a & b) / len(a | b)
+
+
+class PageDeduplicator:
+    # Groups near-identical pages, so each group is processed once and its result shared by every page in it
+    def __init__(self, hash_distance, text_similarity):
+        self.hash_distance = hash_distance
+        self.text_similarity = text_similarity
+        self._originals = {}
+        self._lock = threading.Lock()
+
+    def claim(self, page, ocr_string, image):
+        # Return the decision if this page repeats an earlier one, or register it as the original of a new group
+        shingles = text_shingles(ocr_string)
+        if not shingles:
+            # Without text the small image hash alone cannot tell pages apart, e.g. image-only pages or failed OCR
+            return None
+        image_hash = dhash(image)
+        with self._lock:
+            for original, (original_hash, original_shingles, _) in self._originals.items():
+                distance = hamming_distance(image_hash, original_hash)
+                if distance > self.hash_distance:
+                    continue
+                similarity = jaccard_similarity(shingles, original_shingles)
+                if similarity >= self.text_similarity:
+                    return {
+                        'page': page + 1,
+                        'duplicate_of': original + 1,
+                        'hash_distance': distance,
+                        'text_similarity': round(similarity, 3)
+                    }
+            self._originals[page] = (image_hash, shingles, Future())
+        return None
+
+    def resolve(self, page, future):
+        # Pass an original page's outcome on to the pages waiting for it
+        with self._lock:
+            if page not in self._originals:
+                return
+            target = self._originals[page][2]
+        if future.cancelled():
+            target.cancel()
+        elif future.exception() is not None:
+            target.set_exception(future.exception())
+        else:
+            target.set_result(future.result())
+
+    def result(self, decision):
+        with self._lock:
+            target = self._originals[decision['duplicate_of'] - 1][2]
+        return target.result()
@@ -0,0 +1,116 @@
+import os
+import shutil
+import tempfile
+import threading
+import uuid
+import weakref
+from collections import OrderedDict
+from io import BytesIO
+
+from pdf_pages import iter_page_images
+
+PAGE_STORE_MAX_MB = int(os.environ.get('PAGE_STORE_MAX_MB', 256))
+PAGE_STORE_DIR = os.environ.get('PAGE_STORE_DIR')
+
+
+class PageStore:
+    # Holds compressed page images in memory up to a byte budget shared by all sessions,
+    # spilling the least recently used pages to disk
+    def __init__(self, max_bytes, spill_dir=None):
+        self.max_bytes = max_bytes
+        self.spill_dir = tempfile.mkdtemp(prefix='page-store-', dir=spill_dir)
+        self._memory = OrderedDict()
+        self._memory_bytes = 0
+        self._spilled = {}
+        self._lock = threading.Lock()
+        weakref.finalize(self, shutil.rmtree, self.spill_dir, True)
+
+    def _spill_path(self, document, page):
+        return os.path.join(self.spill_dir, document, f'page-{page + 1:04d}.png')
+
+    def _spill(self, key, data):
+        path = self._spill_path(*key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(data)
+        self._spilled[key] = path
+
+    def put(self, document, page, data):
+        key = (document, page)
+        with self._lock:
+            if key in self._memory:
+                self._memory_bytes -= len(self._memory.pop(key))
+            self._spilled.pop(key, None)
+            self._memory[key] = data
+            self._memory_bytes += len(data)
+            while self._memory_bytes > self.max_bytes:
+                spilled_key, spilled_data = self._memory.popitem(last=False)
+                self._memory_bytes -= len(spilled_data)
+                self._spill(spilled_key, spilled_data)
+
+    def get(self, document, page):
+        key = (document, page)
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                return self._memory[key]
+            path = self._spilled[key]
+        with open(path, 'rb') as f:
+            return f.read()
+
+    def release(self, document):
+        with self._lock:
+            for key in [key for key in self._memory if key[0] == document]:
+                self._memory_bytes -= len(self._memory.pop(key))
+            for key in [key for key in self._spilled if key[0] == document]:
+                del self._spilled[key]
+        shutil.rmtree(os.path.join(self.spill_dir, document), ignore_errors=True)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'documents': len({key[0] for key in [*self._memory, *self._spilled]}),
+                'memory_pages': len(self._memory),
+                'memory_bytes': self._memory_bytes,
+                'spilled_pages': len(self._spilled)
+            }
+
+
+class PageHandle:
+    # A document's pages are kept under a handle while they are processed; they are released when processing ends,
+    # or when the handle is garbage collected
+    def __init__(self, store):
+        self.store = store
+        self.document = uuid.uuid4().hex
+        self._finalizer = weakref.finalize(self, store.release, self.document)
+
+    def put(self, page, data):
+        self.store.put(self.document, page, data)
+
+    def open(self, page):
+        return BytesIO(self.store.get(self.document, page))
+
+    def release(self):
+        self._finalizer()
+
+
+def store_page_images(handle, pdf_bytes, pages, dpi=200):
+    # Render pages one at a time into the store, yielding each page once it can be opened
+    with tempfile.TemporaryDirectory(prefix='page-render-') as render_dir:
+        for page, path in iter_page_images(pdf_bytes, pages, render_dir, dpi=dpi):
+            with open(path, 'rb') as f:
+                handle.put(page, f.read())
+            os.remove(path)
+            yield page
+
+
+_default_store = None
+_default_store_lock = threading.Lock()
+
+
+def get_default_store():
+    global _default_store
+    with _default_store_lock:
+        if _default_store is None:
+            _default_store = PageStore(PAGE_STORE_MAX_MB * 1024 * 1024, PAGE_STORE_DIR)
+        return _default_store
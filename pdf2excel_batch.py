@@ -0,0 +1,212 @@
+import argparse
+import hashlib
+import os
+import sys
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+from functools import partial
+
+from PDF2EXCEL import collect_extracts, process_pages
+from batch_backend import BATCH_BACKENDS, DeferredClient, create_batch_backend, run_deferred
+from batch_files import PageCheckpoints, find_pdfs
+from exports import create_excel_binary_from_json
+from image_encoding import ENCODING_POLICIES
+from instrumentation import Tracer
+from ocr_engines import OCREngine, create_ocr_engine
+from openai_pool import RateLimitedClient, get_rate_limiter, get_shared_client
+from page_store import PageHandle, get_default_store, store_page_images
+from pdf_pages import count_pages
+
+
+class CheckpointedOCREngine(OCREngine):
+    # Keeps the OCR text of each page with its checkpoints, and only starts the wrapped engine when a page lacks it,
+    # so reruns and deferred rounds do not pay for parsing the same document again
+    def __init__(self, create_engine, checkpoints, pages):
+        self.checkpoints = checkpoints
+        self.texts = {page: checkpoints.load_ocr(page) for page in pages}
+        self.engine = None
+        if any(text is None for text in self.texts.values()):
+            self.engine = create_engine()
+
+    def start(self, pdf_bytes, file_name):
+        if self.engine is not None:
+            self.engine.start(pdf_bytes, file_name)
+
+    def submit(self, page, open_page):
+        if self.texts[page] is not None:
+            future = Future()
+            future.set_result(self.texts[page])
+            return future
+        future = self.engine.submit(page, open_page)
+        future.add_done_callback(partial(self._save, page))
+        return future
+
+    def _save(self, page, future):
+        if not future.cancelled() and future.exception() is None:
+            self.checkpoints.save_ocr(page, future.result())
+
+    def close(self):
+        if self.engine is not None:
+            self.engine.close()
+
+
+def convert_document(client, pdf_path, settings, tracer, args):
+    with open(pdf_path, 'rb') as f:
+        pdf_bytes = f.read()
+    checkpoints = PageCheckpoints(os.path.join(args.checkpoint_dir, hashlib.sha256(pdf_bytes).hexdigest()))
+    name = os.path.basename(pdf_path)
+    # Documents share the rate limiter as separate sessions, so one large PDF cannot starve the others; deferred
+    # requests are sent later in batches instead
+    if not isinstance(client, DeferredClient):
+        client = RateLimitedClient(client, get_rate_limiter(), name)
+
+    # Resume from the pages finished by earlier runs
+    page_count = count_pages(pdf_bytes)
+    if args.page_limit is not None:
+        page_count = min(args.page_limit, page_count)
+    results = {i: result for i, result in checkpoints.load().items() if i < page_count}
+    remaining = [i for i in range(page_count) if i not in results]
+
+    if remaining:
+        def save_page(i, result):
+            checkpoints.save(i, result)
+            print(f'{name}: page {i + 1} of {page_count} done', flush=True)
+
+        create_engine = partial(
+            create_ocr_engine,
+            settings['ocr_engine'],
+            llama_cloud_api_key=os.environ.get('LLAMA_CLOUD_API_KEY'),
+            max_workers=settings['max_workers']
+        )
+        ocr_engine = CheckpointedOCREngine(create_engine, checkpoints, remaining)
+        page_handle = PageHandle(get_default_store())
+
+        def iter_pages():
+            for i in store_page_images(page_handle, pdf_bytes, remaining, dpi=settings['image_policy']['dpi']):
+                open_page = partial(page_handle.open, i)
+                yield i, open_page, ocr_engine.submit(i, open_page)
+
+        try:
+            with ocr_engine:
+                ocr_engine.start(pdf_bytes, name)
+                results.update(process_pages(client, iter_pages(), settings, lambda i, message: None,
+                                             on_result=save_page, tracer=tracer))
+        finally:
+            page_handle.release()
+
+    # Write the same Excel and Markdown outputs as the app, once no page is waiting for a batch
+    resumed = page_count - len(remaining)
+    if len(results) < page_count:
+        return {'pages': page_count, 'processed': len(results) - resumed, 'resumed': resumed,
+                'deferred': page_count - len(results)}
+    text_extracts, _, table_extracts = collect_extracts(results)
+    base_name = os.path.join(args.output_dir, os.path.splitext(name)[0])
+    with open(base_name + '.xlsx', 'wb') as f:
+        f.write(create_excel_binary_from_json(table_extracts))
+    with open(base_name + '.md', 'w', encoding='utf-8') as f:
+        f.write('\n\n'.join(text_extracts))
+
+    return {'pages': page_count, 'processed': len(remaining), 'resumed': resumed, 'deferred': 0}
+
+
+def convert_documents(client, pdf_paths, settings, tracer, args, summaries):
+    # Documents form the job queue; each one runs its own bounded page pool. Deferred rounds add their pages to the
+    # summaries of earlier rounds
+    failures = {}
+    with ThreadPoolExecutor(max_workers=args.document_workers) as executor:
+        futures = {executor.submit(convert_document, client, path, settings, tracer, args): path for path in pdf_paths}
+        for future in as_completed(futures):
+            path = futures[future]
+            name = os.path.basename(path)
+            try:
+                summary = future.result()
+            except Exception as e:
+                summaries.pop(path, None)
+                failures[path] = e
+                print(f'{name}: failed ({e!r}), rerun to resume', flush=True)
+                continue
+            if path in summaries:
+                summary.update(processed=summaries[path]['processed'] + summary['processed'],
+                               resumed=summaries[path]['resumed'])
+            summaries[path] = summary
+            if summary['deferred']:
+                print(f"{name}: {summary['deferred']} pages waiting for a batch", flush=True)
+            else:
+                print(f'{name}: complete', flush=True)
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Convert the tables in many PDFs into Excel files, headless')
+    parser.add_argument('source', help='directory of PDFs, or a manifest file with one PDF path per line')
+    parser.add_argument('--output-dir', default='output', help='where .xlsx and .md outputs are written')
+    parser.add_argument('--checkpoint-dir', default='.cache/checkpoints', help='where finished pages are kept')
+    parser.add_argument('--document-workers', type=int, default=2, help='documents processed at the same time')
+    parser.add_argument('--page-workers', type=int, default=4, help='pages processed at the same time per document')
+    parser.add_argument('--page-limit', type=int, default=None, help='maximum pages to process per document')
+    parser.add_argument('--image-policy', default='lossless', choices=sorted(ENCODING_POLICIES))
+    parser.add_argument('--table-threshold', type=float, default=0.5)
+    parser.add_argument('--dedup-hash-distance', type=int, default=6,
+                        help='maximum perceptual hash distance between repeated pages, -1 to disable')
+    parser.add_argument('--dedup-text-similarity', type=float, default=0.9,
+                        help='minimum OCR text similarity between repeated pages')
+    parser.add_argument('--table-cropping', action='store_true',
+                        help='send only the table regions of pages; the .md transcription then leaves out other text')
+    parser.add_argument('--trace', default=None, help='write a JSON trace here, and Prometheus metrics next to it')
+    parser.add_argument('--ocr-engine', choices=['llamaparse', 'tesseract'],
+                        default='llamaparse' if 'LLAMA_CLOUD_API_KEY' in os.environ else 'tesseract')
+    parser.add_argument('--deferred', action='store_true',
+                        help='send the LLM requests as batch jobs, which are slower but cheaper, and wait for them')
+    parser.add_argument('--batch-backend', default='openai', choices=sorted(BATCH_BACKENDS),
+                        help='the OpenAI Batch API, or a local stand-in that runs the batch files itself')
+    parser.add_argument('--batch-dir', default='.cache/batches', help='where batch request and result files are kept')
+    parser.add_argument('--batch-poll-interval', type=float, default=30, help='seconds between batch status checks')
+    args = parser.parse_args()
+
+    settings = {
+        'max_workers': args.page_workers,
+        'image_policy': ENCODING_POLICIES[args.image_policy],
+        'table_threshold': args.table_threshold,
+        'ocr_engine': args.ocr_engine,
+        'dedup_hash_distance': args.dedup_hash_distance,
+        'dedup_text_similarity': args.dedup_text_similarity,
+        'table_cropping': args.table_cropping
+    }
+    client = get_shared_client(os.environ['OPENAI_API_KEY'])
+    os.makedirs(args.output_dir, exist_ok=True)
+    pdf_paths = find_pdfs(args.source)
+
+    start = time.perf_counter()
+    tracer = Tracer()
+    summaries = {}
+    if args.deferred:
+        # Each round runs every page up to its next unanswered request, then sends those requests as batches
+        backend = create_batch_backend(args.batch_backend, client, args.batch_dir)
+        failures = run_deferred(
+            lambda deferred_client: convert_documents(deferred_client, pdf_paths, settings, tracer, args, summaries),
+            backend, args.batch_dir, args.batch_poll_interval
+        )
+    else:
+        failures = convert_documents(client, pdf_paths, settings, tracer, args, summaries)
+    elapsed = time.perf_counter() - start
+
+    # Throughput only counts pages that were processed in this run
+    processed = sum(summary['processed'] for summary in summaries.values())
+    resumed = sum(summary['resumed'] for summary in summaries.values())
+    print(f'Documents: {len(summaries)} complete, {len(failures)} failed')
+    print(f'Pages: {processed} processed, {resumed} resumed from checkpoints')
+    print(f'Elapsed: {elapsed:.1f}s, throughput: {processed / elapsed * 60 if elapsed else 0:.1f} pages/minute')
+    for stage in tracer.summary():
+        print(f"  {stage['stage']:<12}{stage['count']:>6} runs{stage['mean_wall_seconds']:>10.2f}s mean"
+              f"{stage['prompt_tokens'] + stage['completion_tokens']:>12} tokens")
+
+    if args.trace is not None:
+        with open(args.trace, 'w') as f:
+            f.write(tracer.to_json())
+        with open(os.path.splitext(args.trace)[0] + '.prom', 'w') as f:
+            f.write(tracer.to_prometheus())
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
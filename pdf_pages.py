@@ -0,0 +1,22 @@
+from pdf2image import convert_from_bytes, pdfinfo_from_bytes
+
+
+def count_pages(pdf_bytes):
+    return pdfinfo_from_bytes(pdf_bytes)['Pages']
+
+
+def iter_page_images(pdf_bytes, pages, output_folder, dpi=200):
+    # Render only the requested (zero-based) pages, one at a time, to PNG files in the output folder
+    for page in pages:
+        paths = convert_from_bytes(
+            pdf_bytes,
+            dpi=dpi,
+            fmt='png',
+            first_page=page + 1,
+            last_page=page + 1,
+            output_folder=output_folder,
+            output_file=f'page-{page + 1:04d}',
+            single_file=True,
+            paths_only=True
+        )
+        yield page, paths[0]
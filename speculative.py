@@ -0,0 +1,60 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+
+SPECULATIVE_CACHE_SECONDS = float(os.environ.get('SPECULATIVE_CACHE_SECONDS', 60))
+
+
+class SpeculativeExecutor:
+    # Runs pure functions in the background before their results are asked for, memoized on their exact arguments.
+    # Arguments may be futures of earlier submissions, which are waited for first; since those are memoized too,
+    # changing one input only reruns the functions that depend on it. Results older than max_age are computed again,
+    # for functions that read data which can change, such as the contributions store
+    def __init__(self, max_workers=4, max_entries=1024, max_age=None):
+        self.max_entries = max_entries
+        self.max_age = max_age
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='speculative')
+        self._futures = OrderedDict()
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+
+    @staticmethod
+    def _call(fn, args):
+        return fn(*[arg.result() if isinstance(arg, Future) else arg for arg in args])
+
+    def submit(self, fn, *args):
+        key = (fn, args)
+        now = time.monotonic()
+        with self._lock:
+            future, submitted_at = self._futures.get(key, (None, None))
+            # Failed runs are not kept, so asking again retries them
+            if (future is None or future.done() and (future.cancelled() or future.exception() is not None)
+                    or self.max_age is not None and now - submitted_at > self.max_age):
+                future = self._pool.submit(self._call, fn, args)
+                self._futures[key] = (future, now)
+                self._misses += 1
+            else:
+                self._hits += 1
+            self._futures.move_to_end(key)
+            while len(self._futures) > self.max_entries:
+                self._futures.popitem(last=False)
+        return future
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self._hits, 'misses': self._misses, 'entries': len(self._futures)}
+
+
+_default_executor = None
+_default_executor_lock = threading.Lock()
+
+
+def get_default_executor():
+    global _default_executor
+    with _default_executor_lock:
+        if _default_executor is None:
+            _default_executor = SpeculativeExecutor(max_age=SPECULATIVE_CACHE_SECONDS)
+        return _default_executor
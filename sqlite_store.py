@@ -0,0 +1,48 @@
+import argparse
+import json
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+
+class SQLiteStore:
+    # Base of the stores kept in a SQLite file, which are safe to share across threads and processes
+    def __init__(self, path, schema):
+        self.path = path
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._connect().executescript(schema)
+
+    def _connect(self):
+        # SQLite connections cannot be shared between threads, so keep one per thread
+        if not hasattr(self._local, 'conn'):
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return self._local.conn
+
+    @contextmanager
+    def transaction(self):
+        # Take the write lock up front, so concurrent writers wait for each other instead of failing to upgrade a read
+        conn = self._connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            yield conn
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+
+
+def run_admin_command(description, get_store):
+    # Command line entry point of the stores that can be inspected or cleared
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument('command', choices=['stats', 'clear'])
+    args = parser.parse_args()
+
+    if args.command == 'stats':
+        print(json.dumps(get_store().stats(), indent=2))
+    else:
+        get_store().clear()
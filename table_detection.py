@@ -0,0 +1,128 @@
+import re
+
+import numpy as np
+
+TABLE_ROW_PATTERN = re.compile(r'^\s*\|.*\|\s*$')
+
+# Width that pages are downscaled to before looking for ruling lines
+ANALYSIS_WIDTH = 800
+
+
+def markdown_table_score(text, min_rows=3):
+    # Longest run of pipe-table lines in the OCR Markdown, relative to the smallest table worth extracting
+    longest_run = run = 0
+    for line in text.splitlines():
+        run = run + 1 if TABLE_ROW_PATTERN.match(line) else 0
+        longest_run = max(longest_run, run)
+    return min(1.0, longest_run / min_rows)
+
+
+def to_ink_mask(image):
+    image = image.convert('L')
+    height = max(1, round(image.height * ANALYSIS_WIDTH / image.width))
+    pixels = np.asarray(image.resize((ANALYSIS_WIDTH, height)))
+    return pixels < 128
+
+
+def count_lines(coverage, min_coverage):
+    # Count runs of adjacent rows (or columns) whose ink covers most of the page
+    is_line = (coverage >= min_coverage).astype(np.int8)
+    return int(is_line[0] + np.count_nonzero(np.diff(is_line) == 1))
+
+
+def ruling_line_score(ink, min_lines=4):
+    # Long horizontal and vertical rules are a cheap signal for bordered tables
+    horizontal_lines = count_lines(ink.mean(axis=1), 0.5)
+    vertical_lines = count_lines(ink.mean(axis=0), 0.2)
+    return min(1.0, (horizontal_lines + vertical_lines) / min_lines)
+
+
+def find_runs(mask):
+    # Start and end (exclusive) of each run of True values
+    edges = np.diff(np.concatenate([[0], mask.astype(np.int8), [0]]))
+    return list(zip(np.flatnonzero(edges == 1), np.flatnonzero(edges == -1)))
+
+
+def find_ruled_bands(ink, min_coverage=0.5, max_gap=0.25):
+    # Vertical extents of groups of at least two horizontal rules, e.g. the borders of a table's rows
+    rules = find_runs(ink.mean(axis=1) >= min_coverage)
+    bands = []
+    group = rules[:1]
+    for rule in rules[1:]:
+        if rule[0] - group[-1][1] <= max_gap * ink.shape[0]:
+            group.append(rule)
+            continue
+        bands.append(group)
+        group = [rule]
+    bands.append(group)
+    return [(group[0][0], group[-1][1]) for group in bands if len(group) >= 2]
+
+
+def find_column_blocks(ink, min_rows=3, min_gutters=2, min_gutter_width=0.02):
+    # Vertical extents of text blocks whose lines share blank gutters, e.g. borderless tables
+    lines = find_runs(ink.any(axis=1))
+    if not lines:
+        return []
+    line_height = np.median([end - start for start, end in lines])
+
+    # Split text lines into blocks at gaps wider than about a blank line
+    blocks = []
+    block = lines[:1]
+    for line in lines[1:]:
+        if line[0] - block[-1][1] <= 2 * line_height:
+            block.append(line)
+            continue
+        blocks.append(block)
+        block = [line]
+    blocks.append(block)
+
+    column_blocks = []
+    for block in blocks:
+        if len(block) < min_rows:
+            continue
+        top, bottom = block[0][0], block[-1][1]
+        columns = ink[top:bottom].any(axis=0)
+        inked = np.flatnonzero(columns)
+        gaps = find_runs(~columns[inked[0]:inked[-1] + 1])
+        gutters = [gap for gap in gaps if gap[1] - gap[0] >= min_gutter_width * ink.shape[1]]
+        if len(gutters) >= min_gutters:
+            column_blocks.append((top, bottom))
+    return column_blocks
+
+
+def table_score(ocr_string, image):
+    # Pipe tables in the OCR text, ruling lines, or text columns separated by blank gutters; the last one catches
+    # borderless tables that plain-text OCR such as Tesseract does not mark up
+    ink = to_ink_mask(image)
+    column_score = 1.0 if find_column_blocks(ink) else 0.0
+    return max(markdown_table_score(ocr_string), ruling_line_score(ink), column_score)
+
+
+def find_table_regions(image, margin=0.06, max_coverage=0.6):
+    # Boxes around the likely tables of a page in image coordinates, padded above to keep their titles;
+    # empty when none stand out, or when they cover most of the page and cropping would not pay off
+    ink = to_ink_mask(image)
+    height, width = ink.shape
+    bands = sorted(find_ruled_bands(ink) + find_column_blocks(ink))
+
+    # Pad each band and merge the ones that overlap
+    merged = []
+    for top, bottom in bands:
+        top = max(0, top - round(margin * height))
+        bottom = min(height, bottom + round(margin * height / 4))
+        if merged and top <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], bottom))
+        else:
+            merged.append((top, bottom))
+    if sum(bottom - top for top, bottom in merged) > max_coverage * height:
+        return []
+
+    # Trim each band to its inked columns, keeping a small side margin
+    scale = image.width / width
+    regions = []
+    for top, bottom in merged:
+        inked = np.flatnonzero(ink[top:bottom].any(axis=0))
+        left = max(0, inked[0] - round(margin * width / 3))
+        right = min(width, inked[-1] + 1 + round(margin * width / 3))
+        regions.append(tuple(round(value * scale) for value in (left, top, right, bottom)))
+    return regions
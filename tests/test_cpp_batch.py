@@ -0,0 +1,50 @@
+import io
+from datetime import datetime
+
+import pandas as pd
+
+from contributions import ContributionsProvider
+from cpp_batch import assess_forms, build_frame
+
+
+class RecordingContributions(ContributionsProvider):
+    def __init__(self, totals):
+        self.totals = totals
+        self.looked_up = []
+
+    def lookup(self, sin):
+        self.looked_up.append(sin)
+        return self.totals.get(sin)
+
+
+def form(sin, telephone):
+    return {'errors': [], 'pages': {
+        0: {'Social Insurance Number': sin, 'Date of Birth': '1960-04-15', 'Telephone': telephone},
+        1: {},
+        5: {'Pension Start': 'As soon as I qualify', 'As of Date': None},
+        6: {}
+    }}
+
+
+def test_failed_forms_and_blank_sins_keep_int_answers():
+    # Blank answers and failed forms in a column must not turn the other forms' SINs and phone numbers into floats
+    forms = {
+        'complete.pdf': form(123456789, 6135550100),
+        'failed.pdf': {'errors': ['page 1: RuntimeError()'], 'pages': {}},
+        'blank.pdf': form(None, None)
+    }
+    frame = build_frame(forms)
+    provider = RecordingContributions({'123456789': 90000.0})
+    extracted = frame['Status'] != 'failed'
+    assessed = assess_forms(frame[extracted].copy(), provider, datetime(2026, 10, 18)).set_index('File')
+
+    assert provider.looked_up == ['123456789']
+    assert assessed.loc['complete.pdf', 'Past contributions'] == 90000.0
+    assert assessed.loc['complete.pdf', 'CPP eligible']
+    assert assessed.loc['blank.pdf', 'Past contributions'] == 0.0
+    assert not assessed.loc['blank.pdf', 'CPP eligible']
+
+    csv = io.StringIO()
+    pd.concat([assessed.reset_index(), frame[~extracted]]).to_csv(csv, index=False)
+    assert ',123456789,' in csv.getvalue()
+    assert ',6135550100,' in csv.getvalue()
@@ -0,0 +1,64 @@
+import random
+from datetime import datetime, timedelta
+
+import numpy as np
+import pytest
+
+from cpp_rules import (MAXIMUM_AGE, MINIMUM_AGE, STANDARD_AGE, add_years, age_eligibility, assess_age_eligibility,
+                       calculate_payment, payment_scenarios, turning_age)
+
+LEAP_YEARS = [year for year in range(1940, 1980) if year % 4 == 0]
+
+
+def random_applicants(rng, today, count):
+    # Mostly random birth dates, with many February 29 birthdays and many turning 60 within weeks of today
+    applicants = []
+    for _ in range(count):
+        kind = rng.random()
+        if kind < 0.2:
+            birth_date = datetime(rng.choice(LEAP_YEARS), 2, 29)
+        elif kind < 0.5:
+            birth_date = add_years(today, -MINIMUM_AGE) + timedelta(days=rng.randint(-40, 40))
+        else:
+            birth_date = datetime(1940, 1, 1) + timedelta(days=rng.randint(0, 40 * 365))
+        applicants.append({
+            'date_of_birth': f'{birth_date:%Y-%m-%d}',
+            'pension_start': rng.choice(['As soon as I qualify', 'As of']),
+            'start_date': f'{rng.randint(1995, 2055)}-{rng.randint(1, 12):02d}',
+            'contributions': round(rng.uniform(0, 200000), 2)
+        })
+    return applicants
+
+
+@pytest.mark.parametrize('today', [
+    datetime(2024, 2, 28), datetime(2024, 2, 29), datetime(2025, 2, 28), datetime(2025, 3, 1), datetime(2026, 10, 18)
+])
+def test_vectorized_rules_match_the_scalar_ones(today):
+    applicants = random_applicants(random.Random(today.toordinal()), today, 1000)
+    birth_dates = np.array([applicant['date_of_birth'] for applicant in applicants])
+    as_soon_as_qualified = np.array([applicant['pension_start'] == 'As soon as I qualify' for applicant in applicants])
+    start_dates = np.where(as_soon_as_qualified, f'{today:%Y-%m-%d}',
+                           [applicant['start_date'] + '-01' for applicant in applicants])
+    contributions = np.array([applicant['contributions'] for applicant in applicants])
+
+    assessments = [assess_age_eligibility(applicant['date_of_birth'], today) for applicant in applicants]
+    assert age_eligibility(birth_dates, today).tolist() == [assessment['eligible'] for assessment in assessments]
+    assert turning_age(birth_dates, MINIMUM_AGE).tolist() == [
+        assessment['date_turning_60'].date() for assessment in assessments
+    ]
+    # 60 years after February 29 is always a leap year, unlike 65 years after it
+    for years in [STANDARD_AGE, MAXIMUM_AGE]:
+        assert turning_age(birth_dates, years).tolist() == [
+            add_years(datetime.strptime(birth_date, '%Y-%m-%d'), years).date() for birth_date in birth_dates
+        ]
+
+    calculations = [calculate_payment(**applicant, today=today) for applicant in applicants]
+    scenarios = payment_scenarios(birth_dates, start_dates, contributions, as_soon_as_qualified)
+    assert scenarios['start_month'].tolist() == [
+        np.datetime64(calculation['pension_start_date'], 'M').item() for calculation in calculations
+    ]
+    assert scenarios['delta_months'].tolist() == [calculation['delta_months'] for calculation in calculations]
+    assert scenarios['percentage_impact'] == pytest.approx(
+        [calculation['percentage_impact'] for calculation in calculations]
+    )
+    assert scenarios['payment'] == pytest.approx([calculation['payment'] for calculation in calculations])
@@ -0,0 +1,76 @@
+import pytest
+
+from markdown_tables import END_OF_TABLE, coerce_number, normalise_rows, parse_table_chunk, split_table_chunks
+
+
+@pytest.mark.parametrize('cell, value', [
+    ('1,234', 1234),
+    ('$1,234.50', 1234.5),
+    ('(56.5)', -56.5),
+    ('($ 1,000)', -1000),
+    ('-7', -7),
+    ('−3.25', -3.25),
+    ('0', 0),
+    ('0.75', 0.75)
+])
+def test_numbers_are_coerced(cell, value):
+    assert coerce_number(cell) == value
+    assert type(coerce_number(cell)) is type(value)
+
+
+@pytest.mark.parametrize('cell', ['007', '01234', '1,23', '12 kg', '(12', '', 'Total'])
+def test_codes_and_text_are_kept(cell):
+    assert coerce_number(cell) == cell
+
+
+@pytest.mark.parametrize('separator', ['|---|---|', '|:--|--:|', '|-|-|', '| :-: | - |'])
+def test_delimiter_rows_are_dropped(separator):
+    chunk = f'| Year | Amount |\n{separator}\n| 2023 | 1,200 |\n'
+    assert parse_table_chunk(chunk, True) == [{'title': '', 'content': [['Year', 'Amount'], [2023, 1200]]}]
+
+
+def test_title_is_the_last_heading_above_the_table():
+    chunk = 'Some intro text\n## Balance Sheet\n**As at December 31**\n| Item | 2023 |\n|---|---|\n| Cash | 5 |\n'
+    assert parse_table_chunk(chunk, True)[0]['title'] == 'As at December 31'
+
+
+def test_title_falls_back_to_the_first_line():
+    chunk = 'Revenue by segment\nin thousands of dollars\n| Segment | Revenue |\n|---|---|\n| Retail | 10 |\n'
+    assert parse_table_chunk(chunk, True)[0]['title'] == 'Revenue by segment'
+
+
+def test_code_fences_are_not_titles():
+    chunk = '```markdown\n| A | B |\n|---|---|\n| 1 | 2 |\n```\n'
+    assert parse_table_chunk(chunk, True) == [{'title': '', 'content': [['A', 'B'], [1, 2]]}]
+
+    chunk = '### Notes\n~~~\n| A | B |\n|---|---|\n| x | y |\n~~~\n'
+    assert parse_table_chunk(chunk, True)[0]['title'] == 'Notes'
+
+
+def test_markup_and_escaped_pipes_are_cleaned():
+    chunk = '| **Name** | *Note* |\n|---|---|\n| A \\| B | line one<br>line two |\n'
+    assert parse_table_chunk(chunk, True)[0]['content'] == [['Name', 'Note'], ['A | B', 'line one line two']]
+
+
+def test_tables_in_one_chunk_keep_their_titles():
+    chunk = '# First\n| A |\n|---|\n| 1 |\n\n# Second\n| B |\n|---|\n| 2 |\n'
+    assert parse_table_chunk(chunk, True) == [
+        {'title': 'First', 'content': [['A'], [1]]},
+        {'title': 'Second', 'content': [['B'], [2]]}
+    ]
+
+
+def test_chunks_that_cannot_be_parsed_return_none():
+    assert parse_table_chunk('| A | B |\n|---|---|\n| 1 | 2\n', True) is None
+    assert parse_table_chunk('The table could not be read.\n', True) is None
+    assert parse_table_chunk('Text after the last table.\n', False) == []
+
+
+def test_split_table_chunks_marks_terminated_chunks():
+    content = f'| A |\n|---|\n| 1 |\n{END_OF_TABLE}\n| B |\n|---|\n| 2 |\n{END_OF_TABLE}\nNO_TABLE_PRESENT'
+    assert [terminated for _, terminated in split_table_chunks(content)] == [True, True, False]
+
+
+def test_rows_are_padded_and_empty_trailing_columns_dropped():
+    assert normalise_rows([['A', 'B', '', ''], ['1'], ['2', '3', '']]) == [['A', 'B'], [1, ''], [2, 3]]
+    assert normalise_rows([['', ''], ['', '']]) == [[''], ['']]